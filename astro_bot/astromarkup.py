@@ -0,0 +1,239 @@
+import re
+
+from report_structure import BLOCK_HEADER_RE
+
+# Локальная вёрстка отчёта в AstroMarkup по тем же правилам, что FINAL_LAYOUT_PROMPT:
+# заголовки блоков → [H1], подзаголовки → [H2], строки планет → [P][B]Планета[/B] — Знак[/P],
+# списки → [L], остальное → [P]; планеты и знаки в тексте выделяются [B].
+
+BLOCK_TITLES = {
+    1: "Общая картина",
+    2: "Эмоции и Луна",
+    3: "Венеры и привязанность",
+    4: "Зоны конфликта",
+    5: "Карма и уроки",
+    6: "Прогноз",
+    7: "Потенциал союза",
+}
+
+PLANET_NAMES = (
+    "Солнце", "Луна", "Меркурий", "Венера", "Марс", "Юпитер", "Сатурн",
+    "Уран", "Нептун", "Плутон", "Лилит", "Северный узел", "Южный узел", "ASC", "Асцендент",
+)
+
+INTRO_HEADER_RE = re.compile(r"^(Ваши планеты|Планеты партн[её]ра)\s*:?$", re.IGNORECASE)
+PLANET_LINE_RE = re.compile(
+    r"^\s*(?:[•\-–—*]\s*)?(" + "|".join(PLANET_NAMES) + r")\s*[—–\-:]\s*(.+?)\s*$",
+    re.IGNORECASE,
+)
+# Подзаголовки из эталонов блоков: "Вы:", "В паре:", "Совет:" и т.п. (с текстом после двоеточия или без)
+SUBHEADER_RE = re.compile(
+    r"^(Вы|Он|Она|В паре|Вторая сторона|Как это работает между вами|Зона риска|Зона напряжения|"
+    r"Что может мешать|Ключ к гармонии|Совет|Рекомендаци[яи]|Рекомендации для гармонии|"
+    r"Ваша ролевая модель|Итог|Вывод)\s*(?::\s*(.*))?$",
+    re.IGNORECASE,
+)
+BULLET_RE = re.compile(r"^\s*[•\-–—*]\s+(.+)$")
+NUMBERED_RE = re.compile(r"^\s*\d{1,2}[.)]\s+(.+)$")
+MD_HEADING_RE = re.compile(r"^\s*#{1,6}\s+(.+?)\s*#*\s*$")
+MD_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+BLOCK_TITLE_PREFIX_RE = re.compile(r"^(?:БЛОК|Блок)\s*\d+\s*[.:—–\-]?\s*")
+# Подзаголовки-характеристики из эталонов: "Вы — структура и чувствительность (Солнце в Козероге, ...)"
+DASH_SUBHEADER_RE = re.compile(r"^(Вы|Он|Она|В паре|Вместе)\s+[—–\-]\s+\S")
+
+# Жёсткие переносы (текст, скопированный из PDF/эталонов): строки не длиннее WRAP_MAX_LINE,
+# перенесённая строка — не короче WRAP_MIN_LINE.
+WRAP_MAX_LINE = 100
+WRAP_MIN_LINE = 60
+_SENTENCE_END = ".!?…:;"
+
+# Планеты и знаки во всех падежах; только с заглавной буквы, чтобы не задеть «рака», «весы» и т.п.
+_LEXICON = (
+    r"Солнц(?:е|а|у|ем)|Лун(?:а|ы|е|у|ой)|Меркури(?:й|я|ю|ем|и)|Венер(?:а|ы|е|у|ой)|"
+    r"Марс(?:а|у|ом|е)?|Юпитер(?:а|у|ом|е)?|Сатурн(?:а|у|ом|е)?|Уран(?:а|у|ом|е)?|"
+    r"Нептун(?:а|у|ом|е)?|Плутон(?:а|у|ом|е)?|Лилит|"
+    r"Ов(?:ен|на|ну|ном|не)|Тел(?:ец|ьца|ьцу|ьцом|ьце)|Близнец(?:ы|ов|ам|ами|ах)|"
+    r"Рак(?:а|у|ом|е)?|Л(?:ев|ьва|ьву|ьвом|ьве)|Дев(?:а|ы|е|у|ой)|Вес(?:ы|ов|ам|ами|ах)|"
+    r"Скорпион(?:а|у|ом|е)?|Стрел(?:ец|ьца|ьцу|ьцом|ьце)|Козерог(?:а|у|ом|е)?|"
+    r"Водоле(?:й|я|ю|ем|е)|Рыб(?:ы|ам|ами|ах)?"
+)
+LEXICON_RE = re.compile(r"(?<![\w\[])(" + _LEXICON + r")(?![\w\]])")
+
+
+def _clean(line: str) -> str:
+    return MD_BOLD_RE.sub(r"[B]\1[/B]", line.strip())
+
+
+def _plain(line: str) -> str:
+    return line.replace("**", "").strip().rstrip(":").strip()
+
+
+def _bold_lexicon(text: str) -> str:
+    """[B] для первого упоминания каждой планеты/знака в абзаце (вне уже выделенного)."""
+    if "[B]" in text:
+        # Модель уже расставила акценты — не смешиваем с автоматическими
+        return text
+    seen = set()
+
+    def repl(m: re.Match) -> str:
+        word = m.group(1)
+        if word in seen:
+            return word
+        seen.add(word)
+        return f"[B]{word}[/B]"
+
+    return LEXICON_RE.sub(repl, text)
+
+
+def _is_heading_like(line: str) -> bool:
+    """Короткая строка без точки в конце — подзаголовок внутри блока."""
+    text = _plain(line)
+    if not text or len(text) > 70 or len(text.split()) > 9:
+        return False
+    if text[-1] in ".!?;,…»\"":
+        return False
+    return text[0].isupper()
+
+
+def _planet_line(line: str) -> re.Match | None:
+    m = PLANET_LINE_RE.match(_plain(line))
+    return m if m and len(m.group(2)) <= 40 else None
+
+
+def _line_kind(line: str) -> str:
+    """"head" — заголовок/строка планеты (к ней ничего не приклеивается), "item" — пункт списка
+    или подзаголовок с текстом (допускает продолжение), "text" — обычная строка."""
+    if (BLOCK_HEADER_RE.match(line) or INTRO_HEADER_RE.match(_plain(line)) or _planet_line(line)
+            or MD_HEADING_RE.match(line)):
+        return "head"
+    m = SUBHEADER_RE.match(line.strip().replace("**", ""))
+    if m:
+        return "item" if m.group(2) else "head"
+    if BULLET_RE.match(line) or NUMBERED_RE.match(line):
+        return "item"
+    return "text"
+
+
+def _unbalanced(text: str) -> bool:
+    return text.count("(") > text.count(")") or text.count("«") > text.count("»")
+
+
+def _logical_lines(report_text: str) -> list[str]:
+    """Склеивает мягко перенесённые строки обратно в абзацы/заголовки.
+
+    Строка продолжает предыдущую, если начинается со строчной буквы или в накопленном
+    тексте не закрыта скобка/кавычка. В группе с жёсткими переносами (все строки короче
+    WRAP_MAX_LINE) длинная строка продолжается и следующим предложением того же абзаца.
+    Пустая строка всегда разделяет абзацы.
+    """
+    out: list[str] = []
+    for group in re.split(r"\n\s*\n", report_text):
+        lines = [line.rstrip() for line in group.splitlines() if line.strip()]
+        wrapped = len(lines) > 1 and max(len(line.strip()) for line in lines) <= WRAP_MAX_LINE
+        current, last, kind = None, "", "head"
+        for line in lines:
+            line_kind = _line_kind(line)
+            text = line.replace("**", "").strip()
+            prev = last.replace("**", "").strip()
+            if line_kind == "item" and text[:1] in "—–" and kind == "text" and prev[-1:] not in _SENTENCE_END:
+                # "...проявление любви" / "— это уважение..." — тире перенесено, а не пункт списка
+                line_kind = "text"
+            joins = False
+            if current is not None and line_kind == "text" and kind != "head":
+                if text[:1].islower() or _unbalanced(current):
+                    joins = True
+                elif kind == "text" and wrapped and len(prev) >= WRAP_MIN_LINE:
+                    joins = prev[-1] not in _SENTENCE_END or not DASH_SUBHEADER_RE.match(text)
+            if joins:
+                current = f"{current} {line.strip()}"
+            else:
+                if current is not None:
+                    out.append(current)
+                current, kind = line.strip(), line_kind
+            last = line
+        if current is not None:
+            out.append(current)
+    return out
+
+
+def _block_title(n: int, candidate: str | None) -> tuple[str, bool]:
+    """Название блока: из следующей строки, если она похожа на заголовок, иначе из BLOCK_TITLES.
+    Возвращает (название, использована ли строка-кандидат)."""
+    if candidate is not None and _is_heading_like(candidate) and not PLANET_LINE_RE.match(candidate):
+        title = BLOCK_TITLE_PREFIX_RE.sub("", _plain(MD_HEADING_RE.sub(r"\1", candidate)))
+        return title or BLOCK_TITLES.get(n, f"Блок {n}"), True
+    return BLOCK_TITLES.get(n, f"Блок {n}"), False
+
+
+def to_astromarkup(report_text: str) -> str:
+    """Разметка AstroMarkup для всего отчёта или одной секции (детерминированно, без LLM)."""
+    lines = _logical_lines(report_text)
+    out: list[str] = []
+    i = 0
+    after_intro_header = False
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        # Строка сразу под "Ваши планеты" — дата и город, обычный абзац
+        prev_intro, after_intro_header = after_intro_header, False
+
+        m = BLOCK_HEADER_RE.match(line)
+        if m:
+            candidate = lines[i] if i < len(lines) else None
+            title, used = _block_title(int(m.group(1)), candidate)
+            if used:
+                i += 1
+            out.append(f"[H1]{title}[/H1]")
+            continue
+
+        if INTRO_HEADER_RE.match(_plain(line)):
+            out.append(f"[H1]{_plain(line)}[/H1]")
+            after_intro_header = True
+            continue
+
+        m = _planet_line(line)
+        if m:
+            out.append(f"[P][B]{m.group(1)}[/B] — {m.group(2)}[/P]")
+            continue
+
+        if prev_intro:
+            out.append(f"[P]{_clean(line)}[/P]")
+            continue
+
+        m = SUBHEADER_RE.match(line.strip().replace("**", ""))
+        if m:
+            out.append(f"[H2]{m.group(1)}[/H2]")
+            if m.group(2):
+                out.append(f"[P]{_bold_lexicon(_clean(m.group(2)))}[/P]")
+            continue
+
+        m = MD_HEADING_RE.match(line)
+        if m:
+            out.append(f"[H2]{_plain(m.group(1))}[/H2]")
+            continue
+
+        plain = _plain(line)
+        if DASH_SUBHEADER_RE.match(plain) and plain[-1] not in ".!?…" and len(plain) <= 160:
+            out.append(f"[H2]{plain}[/H2]")
+            continue
+
+        m = BULLET_RE.match(line)
+        if m:
+            out.append(f"[L]{_bold_lexicon(_clean(m.group(1)))}[/L]")
+            continue
+
+        m = NUMBERED_RE.match(line)
+        if m:
+            # "1. Действия и энергия (Марсы)" — подзаголовок, "1. Договоритесь о ..." — пункт списка
+            if _is_heading_like(m.group(1)):
+                out.append(f"[H2]{_plain(line)}[/H2]")
+            else:
+                out.append(f"[L]{_bold_lexicon(_clean(line))}[/L]")
+            continue
+
+        if _is_heading_like(line) or (line.strip().startswith("**") and line.strip().endswith("**")):
+            out.append(f"[H2]{_plain(line)}[/H2]")
+            continue
+
+        out.append(f"[P]{_bold_lexicon(_clean(line))}[/P]")
+    return "\n".join(out)
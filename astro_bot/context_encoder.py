@@ -0,0 +1,82 @@
+import json
+import re
+from typing import Any
+
+try:  # Точный подсчёт токенов, если установлен tiktoken; иначе — оценка по байтам
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Служебные поля распознавания, которые модели для текста отчёта не нужны
+_SERVICE_KEYS = {"missing", "status", "disputed", "source_text"}
+_PARTNERS = {"client_1": "P1", "client_2": "P2"}
+_PARTNER_RE = re.compile(r"\s*\(Partner\s*([12])\)", re.IGNORECASE)
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    global _encoding
+    if tiktoken is not None:
+        try:
+            if _encoding is None:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            return len(_encoding.encode(text))
+        except Exception:
+            pass
+    # ~4 байта UTF-8 на токен: латиница ~4 символа, кириллица ~2 символа
+    return max(1, len(text.encode("utf-8")) // 4)
+
+
+def _compact(value: Any) -> Any:
+    """Убирает null/пустые значения рекурсивно."""
+    if isinstance(value, dict):
+        items = {k: _compact(v) for k, v in value.items()}
+        return {k: v for k, v in items.items() if v not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [v for v in (_compact(v) for v in value) if v not in (None, "", [], {})]
+    if isinstance(value, str) and value.strip().lower() in ("null", "none", "unknown", "?"):
+        return None
+    return value
+
+
+def encode_client_data(client_data: Any) -> str:
+    """Компактное каноническое представление данных пары для промптов.
+
+    JSON без null-полей и служебных ключей, партнёры — P1/P2 (как в аспектах "Sun(P1) Trine Moon(P2)"),
+    исходный текст пользователя — один раз, после JSON.
+    """
+    if not isinstance(client_data, dict):
+        return str(client_data)
+
+    payload: dict[str, Any] = {}
+    for key, value in client_data.items():
+        if key in _SERVICE_KEYS:
+            continue
+        if key == "aspects" and isinstance(value, list):
+            value = [_PARTNER_RE.sub(r"(P\1)", str(a)).strip() for a in value]
+        payload[_PARTNERS.get(key, key)] = value
+    payload = _compact(payload)
+
+    encoded = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    source_text = client_data.get("source_text")
+    if isinstance(source_text, str) and source_text.strip():
+        encoded += "\n\nsource_text:\n" + source_text.strip()
+    return encoded
+
+
+def legacy_encoding(client_data: Any, repeat_source: bool = True) -> str:
+    """Старый формат (repr словаря [+ повтор source_text]) — только для отчёта об экономии."""
+    legacy = str(client_data)
+    if repeat_source and isinstance(client_data, dict) and client_data.get("source_text"):
+        legacy += "\n\nRAW_SOURCE_TEXT:\n" + str(client_data.get("source_text"))
+    return legacy
+
+
+def encode_for_prompt(client_data: Any, label: str, repeat_source: bool = True) -> str:
+    """encode_client_data + лог, сколько токенов сэкономлено относительно старого формата."""
+    encoded = encode_client_data(client_data)
+    before = estimate_tokens(legacy_encoding(client_data, repeat_source))
+    after = estimate_tokens(encoded)
+    print(f"🧮 Context [{label}]: ~{after} tokens instead of ~{before} (saved ~{before - after})")
+    return encoded
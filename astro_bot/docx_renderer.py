@@ -53,6 +53,13 @@ class DOCXReportGenerator:
 
     def create_docx(self, client_data: dict, full_text: str) -> str:
         """Создание DOCX файла."""
+        doc = self.new_document()
+        self.append_markup(doc, full_text)
+        doc.save(self.output_filename)
+        return self.output_filename
+
+    def new_document(self):
+        """Пустой документ со стилями и титульной шапкой; контент добавляется append_markup."""
         doc = Document()
 
         # Styles definition (simplified)
@@ -109,7 +116,10 @@ class DOCXReportGenerator:
         r2.italic = True
 
         doc.add_paragraph("")
+        return doc
 
+    def append_markup(self, doc, full_text: str) -> None:
+        """Дописывает в doc AstroMarkup (весь отчёт или один блок)."""
         # --- NORMALIZATION STEP (Mirroring PDF Renderer) ---
         # 1. Flatten multi-line blocks into single lines so lines.split works
         def normalize_block(m):
@@ -248,6 +258,3 @@ class DOCXReportGenerator:
                 else:
                     p = doc.add_paragraph(line)
                     p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-
-        doc.save(self.output_filename)
-        return self.output_filename
@@ -1,14 +1,29 @@
+import os
 import time
 from typing import Any
 import asyncio
 import threading
-from collections.abc import Coroutine
-from llm_client import LLMService
-from prompts import MAIN_PERSONA, BLOCK_PROMPTS, VERIFICATION_PROMPT, STYLE_PROMPT, CONSISTENCY_CHECK_PROMPT, FINAL_LAYOUT_PROMPT, FULL_REPORT_PROMPT, REFINE_REPORT_PROMPT
+from collections.abc import Awaitable, Callable, Coroutine
+from llm_client import AsyncLLMService, close_async_client
+from prompts import MAIN_PERSONA, BLOCK_PROMPTS, VERIFICATION_PROMPT, STYLE_PROMPT, CONSISTENCY_CHECK_PROMPT, FULL_REPORT_PROMPT, REFINE_REPORT_PROMPT, BLOCK_LAYOUT_PROMPT, INTRO_PROMPT, REFINE_BLOCK_PROMPT
+from report_structure import BLOCK_HEADER_RE, TOTAL_BLOCKS, block_header, join_sections, locate_blocks, split_report_blocks
+from report_validator import validate_report
+from astromarkup import to_astromarkup
+from context_encoder import encode_for_prompt
+
+# single — один длинный запрос FULL_REPORT_PROMPT; parallel — вводная и 7 блоков параллельно по BLOCK_PROMPTS.
+REPORT_STRATEGY = os.getenv("REPORT_STRATEGY", "single")
+# Сколько блоков генерировать одновременно в режиме parallel.
+REPORT_BLOCK_CONCURRENCY = max(1, int(os.getenv("REPORT_BLOCK_CONCURRENCY", "4")))
+# local — AstroMarkup размечается локально (astromarkup.py); llm — вёрстка по секциям через BLOCK_LAYOUT_PROMPT.
+LAYOUT_MODE = os.getenv("LAYOUT_MODE", "local")
 
 class AstroFlowOrchestrator:
-    def __init__(self):
-        self.llm = LLMService()
+    """Пайплайн отчёта. Основные методы асинхронные (*_async); синхронные обёртки
+    с теми же именами оставлены для скриптов и запускают корутину в отдельном loop-е."""
+
+    def __init__(self, llm: AsyncLLMService | None = None):
+        self.llm = llm or AsyncLLMService()
 
     @staticmethod
     def _run_coro_in_new_loop(coro: Coroutine[Any, Any, Any]) -> Any:
@@ -21,15 +36,16 @@ class AstroFlowOrchestrator:
         error_container: dict[str, BaseException] = {}
 
         def runner():
+            loop = asyncio.new_event_loop()
             try:
-                loop = asyncio.new_event_loop()
                 asyncio.set_event_loop(loop)
                 result_container["result"] = loop.run_until_complete(coro)
             except BaseException as e:
                 error_container["error"] = e
             finally:
                 try:
-                    loop = asyncio.get_event_loop()
+                    # Общий HTTP-клиент привязан к этому loop-у — закрываем вместе с ним
+                    loop.run_until_complete(close_async_client())
                     loop.close()
                 except Exception:
                     pass
@@ -41,34 +57,164 @@ class AstroFlowOrchestrator:
             raise error_container["error"]
         return result_container.get("result")
 
-    def process_compatibility_report(self, client_data_json: Any) -> tuple[str, list[dict[str, Any]]]:
+    def process_compatibility_report(self, client_data_json: Any, strategy: str | None = None) -> tuple[str, list[dict[str, Any]]]:
+        return self._run_coro_in_new_loop(self.process_compatibility_report_async(client_data_json, strategy=strategy))
+
+    async def process_compatibility_report_async(
+        self,
+        client_data_json: Any,
+        on_block: Callable[[int, str], Awaitable[None]] | None = None,
+        strategy: str | None = None,
+    ) -> tuple[str, list[dict[str, Any]]]:
         """
         Основной пайплайн:
         Оптимизированная версия:
         1. Единый запрос на генерацию полного отчета (Блоки 1-7).
-        """
-        # Конвертируем данные в читаемую строку для LLM.
-        data_str = str(client_data_json)
-        if isinstance(client_data_json, dict) and client_data_json.get("source_text"):
-            data_str += "\n\nRAW_SOURCE_TEXT:\n" + str(client_data_json.get("source_text"))
 
-        print("--- STARTING ANALYSIS (OPTIMIZED SINGLE PASS) ---")
+        Если передан on_block, on_block(n, text) вызывается по мере готовности
+        каждой секции (0 — вводная), строго по порядку; после локальной проверки
+        структуры перегенерированные секции приходят ещё раз с тем же номером.
+        strategy: "single" / "parallel" (по умолчанию REPORT_STRATEGY).
+        """
+        # Компактное представление данных для LLM (без null-полей, source_text один раз).
+        data_str = encode_for_prompt(client_data_json, "report")
 
-        # Так как это синхронный метод, а llm_client методы синхронны (внутри OpenAI клиента),
-        # то можно вызывать напрямую. Но старый код использовал to_thread, оставим если нужно.
-        # В llm_client _completion блокирующий.
-        
-        full_text = self.llm.generate_full_report(MAIN_PERSONA, data_str, FULL_REPORT_PROMPT)
+        strategy = strategy or REPORT_STRATEGY
+        if strategy == "parallel":
+            print(f"--- STARTING ANALYSIS (PARALLEL BLOCKS, x{REPORT_BLOCK_CONCURRENCY}) ---")
+            full_text = await self._generate_blocks_parallel(data_str, on_block)
+        elif on_block is not None:
+            print("--- STARTING ANALYSIS (OPTIMIZED SINGLE PASS) ---")
+            full_text = await self.llm.generate_full_report_stream(MAIN_PERSONA, data_str, FULL_REPORT_PROMPT, on_block=on_block)
+        else:
+            print("--- STARTING ANALYSIS (OPTIMIZED SINGLE PASS) ---")
+            full_text = await self.llm.generate_full_report(MAIN_PERSONA, data_str, FULL_REPORT_PROMPT)
         
         # Если генерация упала
         if not full_text or "Ошибка генерации" in full_text:
              return f"К сожалению, не удалось создать отчет. Ошибка: {full_text}", []
 
-        # Возвращаем результат без списка ошибок, так как верификация теперь внедрена в промпт
-        return full_text, []
+        # Локальная проверка структуры; пропущенные/оборванные блоки догенерируются точечно.
+        # Оставшиеся проблемы возвращаются как issues (бот покажет их предупреждением).
+        return await self._repair_report(full_text, client_data_json, data_str, on_block)
+
+    async def _repair_report(
+        self,
+        full_text: str,
+        client_data_json: Any,
+        data_str: str,
+        on_block: Callable[[int, str], Awaitable[None]] | None = None,
+    ) -> tuple[str, list[dict[str, Any]]]:
+        """Перегенерирует только те секции, на которые пожаловался validate_report.
+
+        Исправленные секции повторно отдаются в on_block (с тем же номером — заменяют прежние).
+        """
+        issues = validate_report(full_text, client_data_json)
+        if not issues:
+            return full_text, []
+
+        targets = sorted({item["block_id"] for item in issues if 0 <= item["block_id"] <= TOTAL_BLOCKS})
+        print(f"--- STRUCTURE ISSUES: {issues}; REGENERATING SECTIONS {targets} ---")
+        semaphore = asyncio.Semaphore(REPORT_BLOCK_CONCURRENCY)
+        regenerated = await asyncio.gather(*(self._generate_section(n, data_str, semaphore) for n in targets))
+
+        # Первое вхождение каждого номера, без лишних блоков сверх структуры; исправленные — поверх
+        sections: dict[int, str] = {}
+        for n, text in split_report_blocks(full_text):
+            if n <= TOTAL_BLOCKS:
+                sections.setdefault(n, text)
+        for n, section in zip(targets, regenerated):
+            if "Ошибка генерации" in section:
+                continue
+            sections[n] = section
+            if on_block is not None:
+                await on_block(n, section)
+
+        repaired = join_sections(sorted(sections.items()))
+        return repaired, validate_report(repaired, client_data_json)
+
+    async def _generate_section(self, n: int, data_str: str, semaphore: asyncio.Semaphore) -> str:
+        """Одна секция отдельным запросом: 0 — вводная (INTRO_PROMPT), 1-7 — BLOCK_PROMPTS."""
+        prompt = INTRO_PROMPT if n == 0 else BLOCK_PROMPTS[n]
+        async with semaphore:
+            started = time.monotonic()
+            text = await self.llm.generate_block(MAIN_PERSONA, data_str, prompt)
+        print(f"Block {n} generated in {time.monotonic() - started:.1f}s")
+        # Модель иногда сама пишет заголовок — убираем, чтобы не было дубля
+        body = BLOCK_HEADER_RE.sub("", str(text or "")).strip()
+        return f"{block_header(n)}\n{body}\n\n" if n > 0 else f"{body}\n\n"
+
+    async def _generate_blocks_parallel(
+        self,
+        data_str: str,
+        on_block: Callable[[int, str], Awaitable[None]] | None = None,
+    ) -> str:
+        """Вводная и блоки 1-7 отдельными запросами (не больше REPORT_BLOCK_CONCURRENCY
+        одновременно), склейка по порядку с заголовками "=== БЛОК N ===".
+
+        Время ≈ самый медленный блок, а не сумма. on_block получает секции по порядку:
+        готовый блок ждёт, пока допишутся все предыдущие.
+        """
+        semaphore = asyncio.Semaphore(REPORT_BLOCK_CONCURRENCY)
+        numbers = [0] + sorted(BLOCK_PROMPTS)
+        tasks = [asyncio.create_task(self._generate_section(n, data_str, semaphore)) for n in numbers]
+        parts = []
+        try:
+            for n, task in zip(numbers, tasks):
+                section = await task
+                if "Ошибка генерации" in section:
+                    # Дальше нет смысла ждать: отчёт с дырой всё равно не собрать
+                    return section.strip()
+                parts.append(section)
+                if on_block is not None:
+                    await on_block(n, section)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return "".join(parts)
 
     def refine_report(self, current_report: str, user_feedback: str) -> str:
+        return self._run_coro_in_new_loop(self.refine_report_async(current_report, user_feedback))
+
+    async def refine_report_async(self, current_report: str, user_feedback: str) -> str:
         """Перегенерация/улучшение текста отчета на основе обратной связи пользователя."""
+        refined_text, _changed = await self.refine_report_blocks_async(current_report, user_feedback)
+        return refined_text
+
+    async def refine_report_blocks_async(self, current_report: str, user_feedback: str) -> tuple[str, list[int] | None]:
+        """Правка только тех блоков, к которым относится отзыв (номер блока или цитата).
+
+        Возвращает (новый текст, номера изменённых секций). None вместо списка —
+        правку не удалось привязать к блокам, и отчёт переписан целиком.
+        """
+        sections = split_report_blocks(current_report)
+        targets = locate_blocks(user_feedback, sections)
+        if not targets:
+            return await self._refine_full_report(current_report, user_feedback), None
+
+        print(f"--- REFINING BLOCKS {targets} WITH FEEDBACK: {user_feedback[:50]}... ---")
+        originals = dict(sections)
+        refined = await asyncio.gather(*(self._refine_section(n, originals[n], user_feedback) for n in targets))
+        replaced = dict(zip(targets, refined))
+        changed = [n for n in targets if replaced[n] != originals[n]]
+        new_sections = [(n, replaced.get(n, text)) for n, text in sections]
+        return join_sections(new_sections), changed
+
+    async def _refine_section(self, n: int, section: str, user_feedback: str) -> str:
+        prompt = REFINE_BLOCK_PROMPT.format(current_block=section.strip(), user_feedback=user_feedback)
+        text = await self.llm.run_prompt(
+            system_prompt="Ты — профессиональный астролог-редактор. Следуй инструкциям по доработке текста.",
+            user_prompt=prompt,
+            task="refine",
+        )
+        body = BLOCK_HEADER_RE.sub("", str(text or "")).strip()
+        if not body:
+            # Не получилось — оставляем блок как был
+            return section
+        # Заголовок ставим сами: модель могла его потерять или изменить номер
+        return f"{block_header(n)}\n{body}\n\n" if n > 0 else f"{body}\n\n"
+
+    async def _refine_full_report(self, current_report: str, user_feedback: str) -> str:
         print(f"--- REFINING REPORT WITH FEEDBACK: {user_feedback[:50]}... ---")
         
         prompt = REFINE_REPORT_PROMPT.format(
@@ -76,27 +222,49 @@ class AstroFlowOrchestrator:
             user_feedback=user_feedback
         )
         
-        refined_text = self.llm.run_prompt(
+        refined_text = await self.llm.run_prompt(
             system_prompt="Ты — профессиональный астролог-редактор. Следуй инструкциям по доработке текста.",
-            user_prompt=prompt
+            user_prompt=prompt,
+            task="refine",
         )
         return str(refined_text)
 
     def layout_report_astromarkup(self, client_data_json: Any, report_text: str, issues: list[dict[str, Any]] | None = None) -> str:
-        """Финальная разметка для рендера в DOCX/PDF через простой текстовый формат AstroMarkup."""
-        issues = issues or []
+        return self._run_coro_in_new_loop(self.layout_report_astromarkup_async(client_data_json, report_text, issues))
+
+    async def layout_report_astromarkup_async(self, client_data_json: Any, report_text: str, issues: list[dict[str, Any]] | None = None) -> str:
+        """Финальная разметка для рендера в DOCX/PDF через простой текстовый формат AstroMarkup.
+
+        В режиме llm отчёт размечается по секциям (layout_block_astromarkup_async): целый отчёт
+        не помещается в лимит вывода layout-маршрута. issues оставлен для совместимости вызовов.
+        """
+        if LAYOUT_MODE != "llm":
+            return to_astromarkup(str(report_text))
+        sections = split_report_blocks(str(report_text))
+        semaphore = asyncio.Semaphore(REPORT_BLOCK_CONCURRENCY)
+
+        async def layout(section: str) -> str:
+            async with semaphore:
+                return await self.layout_block_astromarkup_async(client_data_json, section)
+
+        laid_out = await asyncio.gather(*(layout(text) for _, text in sections))
+        return "\n".join(markup.strip() or text for (_, text), markup in zip(sections, laid_out))
+
+    async def layout_block_astromarkup_async(self, client_data_json: Any, section_text: str) -> str:
+        """Разметка AstroMarkup одной секции отчёта (для потоковой сборки файлов)."""
+        if LAYOUT_MODE != "llm":
+            return to_astromarkup(str(section_text))
         payload = (
-            FINAL_LAYOUT_PROMPT
+            BLOCK_LAYOUT_PROMPT
             + "\n\nCLIENT_DATA_JSON:\n"
-            + str(client_data_json)
-            + "\n\nISSUES_JSON:\n"
-            + str(issues)
+            + encode_for_prompt(client_data_json, "block layout", repeat_source=False)
             + "\n\nREPORT_TEXT:\n"
-            + str(report_text)
+            + str(section_text)
         )
-        formatted: Any = self.llm.run_prompt(
+        formatted: Any = await self.llm.run_prompt(
             "Ты — аккуратный редактор-верстальщик.",
             payload,
+            task="layout",
         )
         return formatted if isinstance(formatted, str) else str(formatted)
 
@@ -0,0 +1,343 @@
+import io
+import base64
+from dataclasses import dataclass
+
+try:  # Pillow нужен только для локальной обработки скриншотов; без него бот работает как раньше
+    from PIL import Image, ImageChops, ImageFilter, ImageOps, ImageStat
+except ImportError:  # pragma: no cover
+    Image = None
+
+# Кусок для потокового base64: кратен 3, чтобы куски склеивались без паддинга внутри.
+_B64_CHUNK = 3 * 64 * 1024
+
+
+@dataclass
+class PreparedImage:
+    """Картинка, готовая к отправке в vision-модель."""
+
+    base64: str
+    original_bytes: int
+    processed_bytes: int
+    size: tuple[int, int] | None = None
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.processed_bytes
+
+
+def b64encode_streamed(buffer) -> str:
+    """base64 по кускам из memoryview — без лишней полной копии исходных байт."""
+    view = memoryview(buffer)
+    return "".join(
+        base64.b64encode(view[i:i + _B64_CHUNK]).decode("ascii")
+        for i in range(0, len(view), _B64_CHUNK)
+    )
+
+
+def _autocrop(img, threshold: int = 24, margin: int = 8):
+    """Обрезает однотонные поля вокруг таблицы (фон = цвет левого верхнего угла)."""
+    background = Image.new(img.mode, img.size, img.getpixel((0, 0)))
+    diff = ImageChops.difference(img, background).convert("L")
+    bbox = diff.point(lambda p: 255 if p > threshold else 0).getbbox()
+    if not bbox:
+        return img
+    left, top, right, bottom = bbox
+    bbox = (
+        max(0, left - margin),
+        max(0, top - margin),
+        min(img.width, right + margin),
+        min(img.height, bottom + margin),
+    )
+    if bbox == (0, 0, img.width, img.height):
+        return img
+    return img.crop(bbox)
+
+
+def preprocess_image(
+    image_bytes: bytes,
+    max_side: int = 1600,
+    quality: int = 85,
+    grayscale: bool = False,
+) -> PreparedImage:
+    """Готовит скриншот к vision: обрезка полей, уменьшение, (опционально) серый, пересжатие JPEG.
+
+    max_side подобран так, чтобы глифы знаков в таблице оставались читаемыми.
+    Если обработка не дала выигрыша или Pillow недоступен — уходит исходник
+    (его base64 считается только в этом случае).
+    """
+
+    def original(size: tuple[int, int] | None = None) -> PreparedImage:
+        return PreparedImage(
+            base64=b64encode_streamed(image_bytes),
+            original_bytes=len(image_bytes),
+            processed_bytes=len(image_bytes),
+            size=size,
+        )
+
+    if Image is None:
+        return original()
+    original_size = None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as src:
+            img = ImageOps.exif_transpose(src).convert("RGB")
+        original_size = img.size
+        img = _autocrop(img)
+        if max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+        if grayscale:
+            img = img.convert("L")
+
+        out = io.BytesIO()
+        img.save(out, format="JPEG", quality=quality, optimize=True)
+    except Exception as e:
+        print(f"⚠️ Image preprocessing failed, sending original: {e}")
+        return original(original_size)
+
+    if out.tell() >= len(image_bytes) and img.size == original_size:
+        return original(original_size)
+    return PreparedImage(
+        base64=b64encode_streamed(out.getbuffer()),
+        original_bytes=len(image_bytes),
+        processed_bytes=out.tell(),
+        size=img.size,
+    )
+
+
+def _percentile(histogram: list[int], q: float) -> int:
+    total = sum(histogram)
+    acc = 0
+    for value, count in enumerate(histogram):
+        acc += count
+        if acc >= q * total:
+            return value
+    return len(histogram) - 1
+
+
+# Лапласиан 3x3: дисперсия отклика — стандартная мера резкости (размытое фото -> низкая).
+_LAPLACIAN = (0, 1, 0, 1, -4, 1, 0, 1, 0)
+
+
+def assess_image_quality(
+    image_bytes: bytes,
+    min_long_side: int = 480,
+    min_pixels: int = 120_000,
+    min_sharpness: float = 90.0,
+    min_contrast: float = 60.0,
+    max_aspect: float = 6.0,
+) -> list[str]:
+    """Быстрая локальная проверка, стоит ли вообще отправлять скриншот в vision.
+
+    Возвращает список проблем для пользователя (пустой — картинка годится).
+    Отсекаются только безнадёжные картинки. Разрешение проверяется по длинной стороне
+    и числу пикселей, а не по короткой стороне: Telegram ужимает фото до ~1280px
+    по длинной стороне, и широкая таблица в 1000×300 остаётся вполне читаемой.
+    Резкость и контраст считаются на копии шириной 1000px, чтобы пороги
+    не зависели от исходного размера. Контраст — разброс яркости между 0.5%
+    и 99.5% перцентилями: у таблицы с редким текстом стандартное отклонение
+    маленькое даже при идеальной чёткости. Без Pillow проверка пропускается.
+    """
+    if Image is None:
+        return []
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as src:
+            img = ImageOps.exif_transpose(src).convert("L")
+    except Exception as e:
+        return [f"не удалось открыть изображение ({e})"]
+
+    problems = []
+    width, height = img.size
+    if max(width, height) < min_long_side or width * height < min_pixels:
+        problems.append(f"слишком маленькое разрешение ({width}×{height})")
+    if max(width, height) / max(1, min(width, height)) > max_aspect:
+        problems.append("необычные пропорции — похоже, таблица обрезана или склеена")
+
+    if width > 1000:
+        img = img.resize((1000, max(1, round(height * 1000 / width))), Image.BILINEAR)
+    contrast = _percentile(img.histogram(), 0.995) - _percentile(img.histogram(), 0.005)
+    if contrast < min_contrast:
+        problems.append("слишком низкий контраст (текст сливается с фоном)")
+    laplacian = img.filter(ImageFilter.Kernel((3, 3), _LAPLACIAN, scale=1, offset=128))
+    sharpness = ImageStat.Stat(laplacian).var[0]
+    if sharpness < min_sharpness:
+        problems.append("изображение размыто")
+    return problems
+
+
+@dataclass
+class ImageRegion:
+    """Фрагмент скриншота для отдельного распознавания."""
+
+    kind: str  # "planets" — таблица планет, "aspects" — сетка аспектов
+    base64: str
+    box: tuple[int, int, int, int]
+    # Чья таблица планет по положению фрагмента: 1 — левая/верхняя, 2 — правая/нижняя;
+    # None — таблица одна (в ней оба партнёра) или положение неоднозначно
+    partner: int | None = None
+
+
+def _runs(values: list[int], limit: int) -> list[tuple[int, int]]:
+    """Отрезки подряд идущих индексов со значением <= limit: [(start, end), ...]."""
+    runs = []
+    start = None
+    for i, v in enumerate(values):
+        if v <= limit:
+            if start is None:
+                start = i
+        elif start is not None:
+            runs.append((start, i))
+            start = None
+    if start is not None:
+        runs.append((start, len(values)))
+    return runs
+
+
+def _line_count(values: list[int], min_fill: float) -> int:
+    """Сколько сплошных линий (строк/столбцов, залитых чернилами на min_fill) в проекции."""
+    filled = [v >= min_fill * 255 for v in values]
+    return sum(1 for i, f in enumerate(filled) if f and (i == 0 or not filled[i - 1]))
+
+
+def _text_columns(ink, box) -> int:
+    """Сколько колонок текста в блоке (по пустым промежуткам между залитыми столбцами)."""
+    sub = ink.crop(box)
+    cols = list(sub.resize((sub.width, 1), Image.BOX).getdata())
+    gaps = [(a, b) for a, b in _runs(cols, 1) if a > 0 and b < len(cols)]
+    return len(gaps) + 1 if any(v > 1 for v in cols) else 0
+
+
+def _xy_cut(ink, box, depth: int, min_gap: int, dominance: float = 1.5) -> list[tuple[int, int, int, int]]:
+    """Рекурсивный XY-cut по пустым промежуткам строк/столбцов.
+
+    Режем только по промежутку, заметно (в dominance раз) более широкому, чем остальные
+    на той же оси: промежутки между колонками «Планета | Знак | Градус» бывают шире min_gap,
+    и без этого таблица резалась бы по колонкам. Вертикальный разрез (по x) допускается,
+    только если по обе стороны остаётся хотя бы две колонки текста — целые таблицы.
+    """
+    sub = ink.crop(box)
+    rows = list(sub.resize((1, sub.height), Image.BOX).getdata())
+    cols = list(sub.resize((sub.width, 1), Image.BOX).getdata())
+
+    # Сначала срезаем пустые поля, чтобы промежутки искались только внутри контента
+    row_runs = _runs(rows, 1)
+    col_runs = _runs(cols, 1)
+    top = row_runs[0][1] if row_runs and row_runs[0][0] == 0 else 0
+    bottom = row_runs[-1][0] if row_runs and row_runs[-1][1] == len(rows) else len(rows)
+    left = col_runs[0][1] if col_runs and col_runs[0][0] == 0 else 0
+    right = col_runs[-1][0] if col_runs and col_runs[-1][1] == len(cols) else len(cols)
+    if top >= bottom or left >= right:
+        return []
+    x0, y0 = box[0], box[1]
+    box = (x0 + left, y0 + top, x0 + right, y0 + bottom)
+    if depth <= 0:
+        return [box]
+
+    best = None  # (длина промежутка, ось, середина)
+    for axis, values, lo, hi in (("y", rows, top, bottom), ("x", cols, left, right)):
+        gaps = sorted(
+            ((end - start, lo + (start + end) // 2) for start, end in _runs(values[lo:hi], 1)
+             if start > 0 and end < hi - lo),
+            reverse=True,
+        )
+        if not gaps or gaps[0][0] < min_gap:
+            continue
+        if len(gaps) > 1 and gaps[0][0] < dominance * gaps[1][0]:
+            continue
+        width, cut = gaps[0]
+        if axis == "x":
+            halves = ((box[0], box[1], x0 + cut, box[3]), (x0 + cut, box[1], box[2], box[3]))
+            if any(_text_columns(ink, half) < 2 for half in halves):
+                continue
+        if best is None or width > best[0]:
+            best = (width, axis, cut)
+    if best is None:
+        return [box]
+
+    _, axis, cut = best
+    if axis == "y":
+        first = (box[0], box[1], box[2], y0 + cut)
+        second = (box[0], y0 + cut, box[2], box[3])
+    else:
+        first = (box[0], box[1], x0 + cut, box[3])
+        second = (x0 + cut, box[1], box[2], box[3])
+    return _xy_cut(ink, first, depth - 1, min_gap, dominance) + _xy_cut(ink, second, depth - 1, min_gap, dominance)
+
+
+def _assign_partners(regions: list[ImageRegion]) -> None:
+    """Две таблицы планет — по одной на партнёра: client_1 слева (сверху), client_2 справа (снизу)."""
+    tables = [r for r in regions if r.kind == "planets"]
+    if len(tables) != 2:
+        return
+    (ax0, ay0, ax1, ay1), (bx0, by0, bx1, by1) = tables[0].box, tables[1].box
+    dx = (bx0 + bx1 - ax0 - ax1) / 2
+    dy = (by0 + by1 - ay0 - ay1) / 2
+    # Рядом — решает горизонталь, друг под другом — вертикаль
+    shift = dx if abs(dx) >= abs(dy) else dy
+    first, second = tables if shift > 0 else tables[::-1]
+    first.partner, second.partner = 1, 2
+
+
+def split_regions(
+    image_bytes: bytes,
+    max_side: int = 1600,
+    quality: int = 85,
+    max_regions: int = 6,
+) -> list[ImageRegion]:
+    """Делит скриншот на таблицы планет и сетку аспектов по пустым промежуткам (XY-cut).
+
+    Разметка ищется на копии шириной до 1000px, вырезается из оригинала.
+    Сетка аспектов распознаётся по множеству сплошных горизонтальных И вертикальных
+    линий. Пустой список — разбить не удалось (один блок, слишком много мелких или
+    таблица планет в одну колонку — без знаков), тогда нужно распознавать картинку целиком.
+    """
+    if Image is None:
+        return []
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as src:
+            img = ImageOps.exif_transpose(src).convert("RGB")
+    except Exception as e:
+        print(f"⚠️ Could not split image: {e}")
+        return []
+
+    scale = min(1.0, 1000 / max(img.size))
+    small = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR)
+    background = Image.new("RGB", small.size, small.getpixel((0, 0)))
+    ink = ImageChops.difference(small, background).convert("L").point(lambda p: 255 if p > 40 else 0)
+    # Склеиваем буквы/слова/соседние строки в сплошные блоки, чтобы резать только между таблицами
+    blocks = ink.filter(ImageFilter.MaxFilter(7))
+
+    min_gap = max(8, round(0.03 * max(small.size)))
+    boxes = _xy_cut(blocks, (0, 0, small.width, small.height), depth=3, min_gap=min_gap)
+    min_area = 0.015 * small.width * small.height
+    boxes = [b for b in boxes if (b[2] - b[0]) * (b[3] - b[1]) >= min_area]
+    if len(boxes) < 2 or len(boxes) > max_regions:
+        return []
+
+    regions = []
+    margin = 6
+    for box in boxes:
+        tile_ink = ink.crop(box)
+        rows = list(tile_ink.resize((1, tile_ink.height), Image.BOX).getdata())
+        cols = list(tile_ink.resize((tile_ink.width, 1), Image.BOX).getdata())
+        is_grid = _line_count(rows, 0.6) >= 4 and _line_count(cols, 0.6) >= 4
+        if not is_grid and _text_columns(blocks, box) < 2:
+            # Таблица планет без колонки знаков (или одни знаки без планет) — такой фрагмент
+            # не распознать отдельно, надёжнее отправить картинку целиком
+            return []
+
+        full_box = (
+            max(0, int(box[0] / scale) - margin),
+            max(0, int(box[1] / scale) - margin),
+            min(img.width, int(box[2] / scale) + margin),
+            min(img.height, int(box[3] / scale) + margin),
+        )
+        tile = img.crop(full_box)
+        tile.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        tile.save(out, format="JPEG", quality=quality, optimize=True)
+        regions.append(ImageRegion(
+            kind="aspects" if is_grid else "planets",
+            base64=b64encode_streamed(out.getbuffer()),
+            box=full_box,
+        ))
+    _assign_partners(regions)
+    return regions
@@ -0,0 +1,101 @@
+import bisect
+import math
+import threading
+from collections import deque
+from typing import Any
+
+# Границы корзин гистограммы (сек): геометрическая сетка 0.25 с … ~10 мин, шаг ×1.25
+BUCKET_BOUNDS = tuple(0.25 * 1.25 ** i for i in range(36))
+
+
+class LatencyHistogram:
+    """Гистограмма задержек последних window запросов (успешных и проигравших хеджу).
+
+    Хранятся только номера корзин: старые замеры вытесняются, поэтому
+    перцентили следуют за текущим состоянием провайдера.
+    """
+
+    def __init__(self, window: int = 200):
+        self._samples: deque[int] = deque(maxlen=window)
+        self._counts = [0] * (len(BUCKET_BOUNDS) + 1)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        if len(self._samples) == self._samples.maxlen:
+            self._counts[self._samples[0]] -= 1
+        idx = bisect.bisect_left(BUCKET_BOUNDS, seconds)
+        self._samples.append(idx)
+        self._counts[idx] += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Верхняя граница корзины, в которую попадает q-перцентиль (None — замеров нет)."""
+        if not self._samples:
+            return None
+        rank = max(1, math.ceil(q * len(self._samples)))
+        seen = 0
+        for idx, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return BUCKET_BOUNDS[min(idx, len(BUCKET_BOUNDS) - 1)]
+        return BUCKET_BOUNDS[-1]
+
+
+class LatencyTracker:
+    """Гистограммы задержек по (задача, модель) и порог хеджирования по ним.
+
+    Один экземпляр на процесс (см. llm_client), безопасен для нескольких потоков.
+    """
+
+    def __init__(self, percentile: float = 0.95, min_samples: int = 20, min_delay_s: float = 1.0,
+                 window: int = 200):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay_s = min_delay_s
+        self.window = window
+        self._lock = threading.Lock()
+        self._histograms: dict[str, LatencyHistogram] = {}
+        self._counters = {"hedged": 0, "hedge_wins": 0}
+
+    @staticmethod
+    def key(task: str | None, model: str) -> str:
+        return f"{task or 'direct'}/{model}"
+
+    def record(self, task: str | None, model: str, seconds: float) -> None:
+        with self._lock:
+            key = self.key(task, model)
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram(self.window)
+            histogram.add(seconds)
+
+    def hedge_delay(self, task: str | None, model: str) -> float | None:
+        """Через сколько секунд без ответа слать дубль; None — замеров пока мало."""
+        with self._lock:
+            histogram = self._histograms.get(self.key(task, model))
+            if histogram is None or len(histogram) < self.min_samples:
+                return None
+            return max(self.min_delay_s, histogram.quantile(self.percentile))
+
+    def note_hedge(self, won: bool) -> None:
+        with self._lock:
+            self._counters["hedged"] += 1
+            if won:
+                self._counters["hedge_wins"] += 1
+
+    def stats(self) -> dict[str, Any]:
+        """p50/p95 по каждой паре (задача, модель) и счётчики хеджирования."""
+        with self._lock:
+            return {
+                **self._counters,
+                "latency": {
+                    key: {
+                        "samples": len(h),
+                        "p50_s": round(h.quantile(0.5), 2),
+                        "p95_s": round(h.quantile(0.95), 2),
+                    }
+                    for key, h in sorted(self._histograms.items())
+                },
+            }
+
@@ -0,0 +1,119 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any
+
+
+class LLMResponseCache:
+    """Контентно-адресуемый кэш ответов LLM в SQLite.
+
+    Ключ — sha256 от model + messages + response_format, значение — JSON ответа.
+    Размер ограничен max_bytes (вытесняются давно не читанные записи, LRU),
+    устаревшие по ttl_s записи удаляются при чтении.
+    Один экземпляр можно безопасно использовать из нескольких потоков.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl_s: float):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed)")
+        self._bytes = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, messages: Any, response_format: Any = None, params: dict | None = None) -> str:
+        payload = {"model": model, "messages": messages, "response_format": response_format}
+        if params:
+            # Параметры генерации маршрута (max_tokens/temperature); без них ключи прежние
+            payload["params"] = params
+        raw = json.dumps(
+            payload,
+            ensure_ascii=False,
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT payload, size, created FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._counters["misses"] += 1
+                return None
+            payload, size, created = row
+            if self.ttl_s > 0 and now - created > self.ttl_s:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._bytes -= size
+                self._counters["expired"] += 1
+                self._counters["misses"] += 1
+                return None
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+            self._counters["hits"] += 1
+            return payload
+
+    def put(self, key: str, model: str, payload: str) -> None:
+        size = len(payload.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            old = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            if old is not None:
+                self._bytes -= old[0]
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, model, payload, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, payload, size, now, now),
+            )
+            self._bytes += size
+            self._counters["stores"] += 1
+            self._evict()
+
+    def _evict(self) -> None:
+        """LRU-вытеснение до max_bytes (вызывается под self._lock)."""
+        while self._bytes > self.max_bytes:
+            rows = self._db.execute("SELECT key, size FROM entries ORDER BY accessed LIMIT 32").fetchall()
+            if not rows:
+                self._bytes = 0
+                return
+            for key, size in rows:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._bytes -= size
+                self._counters["evictions"] += 1
+                if self._bytes <= self.max_bytes:
+                    return
+
+    def stats(self) -> dict[str, Any]:
+        """Счётчики для мониторинга (hits/misses/...), плюс текущий размер кэша."""
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": round(self._counters["hits"] / lookups, 3) if lookups else 0.0,
+                "entries": entries,
+                "bytes": self._bytes,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
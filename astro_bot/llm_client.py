@@ -1,75 +1,330 @@
 import os
-from openai import OpenAI
+import asyncio
+import weakref
+from openai import OpenAI, AsyncOpenAI
+from openai.types.chat import ChatCompletion
+import httpx
 import json
 import time
+import threading
+from dataclasses import dataclass
 from dotenv import load_dotenv
+from prompts import FIELD_REQUERY_PROMPT, PLANET_TABLE_EXTRACTION_PROMPT, PLANET_TABLE_PARTNER_HINT, ASPECT_GRID_EXTRACTION_PROMPT, CONTINUE_REPORT_PROMPT
+from llm_cache import LLMResponseCache
+from latency_tracker import LatencyTracker
+from provider_pool import Provider, ProviderPool, ProviderUnavailableError, load_providers
+from report_structure import BlockStreamParser, TOTAL_BLOCKS, block_header, continuation_point, split_report_blocks, strip_to_block
 
 load_dotenv()
 
-class LLMService:
-    def __init__(self):
-        # Используем OpenRouter
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=os.getenv("OPENROUTER_API_KEY"), 
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Параметры общего пула соединений для AsyncLLMService.
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "200"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "50"))
+LLM_KEEPALIVE_EXPIRY_S = float(os.getenv("LLM_KEEPALIVE_EXPIRY_S", "60"))
+# Полный отчёт генерируется минутами, поэтому read-таймаут большой.
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "600"))
+
+# Кэш ответов LLM (одинаковые model + messages + response_format не ходят в сеть повторно).
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".cache", "llm_responses.sqlite3"),
+)
+LLM_CACHE_MAX_MB = float(os.getenv("LLM_CACHE_MAX_MB", "200"))
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+# cache_control-метки на стабильном префиксе промпта (персона + шаблон отчёта) — для провайдеров,
+# которые кэшируют префикс по явной метке (Anthropic, Gemini через OpenRouter). Остальные их игнорируют.
+PROMPT_CACHE_CONTROL = os.getenv("PROMPT_CACHE_CONTROL", "1") == "1"
+# Сколько раз дописывать отчёт, оборванный по лимиту токенов (или без части блоков).
+REPORT_MAX_CONTINUATIONS = int(os.getenv("REPORT_MAX_CONTINUATIONS", "2"))
+# Хеджирование (только AsyncLLMService): если ответа нет дольше LLM_HEDGE_PERCENTILE задержек
+# этой задачи/модели, уходит дубль (на hedge_model маршрута или ту же модель), берётся первый ответ.
+# Дубль оплачивается, поэтому по умолчанию выключено.
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY_S = float(os.getenv("LLM_HEDGE_MIN_DELAY_S", "1.0"))
+# Пул OpenAI-совместимых провайдеров (JSON-список, см. provider_pool.load_providers); пусто — только OpenRouter.
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "")
+# Circuit breaker: после стольких ошибок провайдера подряд (5xx/таймаут/соединение, не 4xx) пара
+# (провайдер, модель) выключается на LLM_CIRCUIT_COOLDOWN_S; последний провайдер модели не выключается.
+LLM_CIRCUIT_FAILURES = int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))
+LLM_CIRCUIT_COOLDOWN_S = float(os.getenv("LLM_CIRCUIT_COOLDOWN_S", "30"))
+
+try:  # HTTP/2 в httpx требует пакет h2 (httpx[http2])
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+OPENROUTER_PROVIDER = Provider(name="openrouter", base_url=OPENROUTER_BASE_URL, api_key_env="OPENROUTER_API_KEY")
+
+# Провайдеры и их здоровье — общие для всех сервисов процесса.
+_provider_pool = ProviderPool(
+    load_providers(LLM_PROVIDERS, OPENROUTER_PROVIDER),
+    failure_threshold=LLM_CIRCUIT_FAILURES,
+    cooldown_s=LLM_CIRCUIT_COOLDOWN_S,
+)
+
+# Один AsyncOpenAI на (event loop, провайдер): httpx-пул привязан к loop-у, в котором создан.
+# В боте loop один, так что фактически это один клиент на провайдера.
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, AsyncOpenAI]]" = weakref.WeakKeyDictionary()
+
+
+def get_async_client(provider: Provider | None = None) -> AsyncOpenAI:
+    """Общий для процесса AsyncOpenAI провайдера (по умолчанию — первого в пуле)
+    с keep-alive пулом и HTTP/2 (если доступен)."""
+    provider = provider or _provider_pool.providers[0]
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(provider.name)
+    if client is None:
+        http_client = httpx.AsyncClient(
+            http2=_HTTP2_AVAILABLE,
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY_S,
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT_S, connect=15.0),
+        )
+        client = AsyncOpenAI(
+            base_url=provider.base_url,
+            # Локальному серверу ключ не нужен, но SDK требует непустую строку
+            api_key=os.getenv(provider.api_key_env) if provider.api_key_env else "none",
+            http_client=http_client,
         )
-        # Единая модель для всего проекта
-        # По запросу: использовать Gemini 3 Pro Preview
-        self.common_model = "google/gemini-3-pro-preview"
-        
-        self.model_main = self.common_model 
-        self.model_text = self.common_model
-        self.model_verifier = self.common_model 
-        self.model_stylist = self.common_model
+        clients[provider.name] = client
+    return client
+
+
+_response_cache: LLMResponseCache | None = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> LLMResponseCache | None:
+    """Общий для процесса кэш ответов (None, если выключен или не открылся)."""
+    global _response_cache
+    if not LLM_CACHE_ENABLED:
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            try:
+                _response_cache = LLMResponseCache(
+                    LLM_CACHE_PATH,
+                    max_bytes=int(LLM_CACHE_MAX_MB * 1024 * 1024),
+                    ttl_s=LLM_CACHE_TTL_S,
+                )
+            except Exception as e:
+                print(f"⚠️ LLM cache disabled: {e}")
+                return None
+        return _response_cache
+
+
+# Задержки успешных запросов по (задача, модель) — общие для всех сервисов процесса.
+_latency_tracker = LatencyTracker(
+    percentile=LLM_HEDGE_PERCENTILE,
+    min_samples=LLM_HEDGE_MIN_SAMPLES,
+    min_delay_s=LLM_HEDGE_MIN_DELAY_S,
+)
+
+
+async def close_async_client() -> None:
+    """Закрывает общие клиенты текущего event loop (при остановке бота/скрипта)."""
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.close()
+
+
+@dataclass(frozen=True)
+class ModelRoute:
+    """Модель и параметры генерации для одного типа задачи (None — не передавать, дефолт провайдера).
+    hedge_model — куда слать хедж-дубль медленного запроса (None — на ту же модель)."""
+    model: str
+    max_tokens: int | None = None
+    temperature: float | None = None
+    hedge_model: str | None = None
+
+    def params(self) -> dict:
+        params = {}
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+        if self.temperature is not None:
+            params["temperature"] = self.temperature
+        return params
+
+
+PRO_MODEL = "google/gemini-3-pro-preview"
+FAST_MODEL = "google/gemini-2.0-flash-001"
+
+# Тип задачи -> модель. Pro — только для текста отчёта и правок, механика — на быстрой модели.
+# Вёрстка идёт по блокам: выход flash-модели ограничен 8192 токенами.
+DEFAULT_MODEL_ROUTES = {
+    "report": ModelRoute(PRO_MODEL),
+    "refine": ModelRoute(PRO_MODEL),
+    "style": ModelRoute(PRO_MODEL),
+    "general": ModelRoute(PRO_MODEL),
+    "layout": ModelRoute(FAST_MODEL, max_tokens=8192, temperature=0.0),
+    "verify": ModelRoute(FAST_MODEL, max_tokens=2048, temperature=0.0),
+    "consistency": ModelRoute(FAST_MODEL, temperature=0.2),
+}
+
+
+def load_model_routes() -> dict[str, ModelRoute]:
+    """DEFAULT_MODEL_ROUTES с переопределениями из env.
+
+    LLM_ROUTES — JSON вида {"layout": {"model": "...", "max_tokens": 4000, "temperature": 0}};
+    LLM_MODEL_<TASK> (например LLM_MODEL_VERIFY) — только модель для задачи.
+    """
+    routes = dict(DEFAULT_MODEL_ROUTES)
+    raw = os.getenv("LLM_ROUTES")
+    if raw:
+        try:
+            for task, cfg in json.loads(raw).items():
+                base = routes.get(task, routes["general"])
+                routes[task] = ModelRoute(
+                    model=cfg.get("model", base.model),
+                    max_tokens=cfg.get("max_tokens", base.max_tokens),
+                    temperature=cfg.get("temperature", base.temperature),
+                    hedge_model=cfg.get("hedge_model", base.hedge_model),
+                )
+        except (ValueError, AttributeError) as e:
+            print(f"⚠️ LLM_ROUTES ignored (invalid JSON): {e}")
+    for task, route in list(routes.items()):
+        model = os.getenv(f"LLM_MODEL_{task.upper()}")
+        if model:
+            routes[task] = ModelRoute(model, route.max_tokens, route.temperature, route.hedge_model)
+    return routes
+
+
+# Основные планеты: по ним считается правило ">=5 планет" и кворум vision-моделей.
+CORE_PLANETS = (
+    "sun",
+    "moon",
+    "mercury",
+    "venus",
+    "mars",
+    "jupiter",
+    "saturn",
+    "uranus",
+    "neptune",
+    "pluto",
+)
+
+
+# Vision-модели по умолчанию (VISION_MODELS — свой список через запятую)
+DEFAULT_VISION_MODELS = (
+    "google/gemini-3-pro-preview",
+    "google/gemini-2.0-flash-001",
+    "openai/gpt-4o-mini",
+)
+
+
+class BaseLLMService:
+    """Общая часть sync/async сервисов: модели, сборка сообщений, слияние распознаваний."""
+
+    def __init__(self):
+        # Маршрутизация по типу задачи (см. DEFAULT_MODEL_ROUTES / LLM_ROUTES)
+        self.routes = load_model_routes()
+        # Модель отчёта (Gemini 3 Pro Preview по умолчанию)
+        self.common_model = self.routes["report"].model
+
+        self.model_main = self.common_model
+        self.model_text = self.routes["refine"].model
+        self.model_verifier = self.routes["verify"].model
+        self.model_stylist = self.routes["style"].model
 
         # Модели для распознавания изображения (попробуем несколько и сольём результат)
         # Важно: список должен содержать только модели с поддержкой image_url.
+        # Моделей больше кворума: двум совпавшим ответам не нужно ждать самую медленную.
         self.vision_models = [
-            "google/gemini-3-pro-preview",
-            "google/gemini-2.0-flash-001",
-        ]
+            m.strip() for m in os.getenv("VISION_MODELS", ",".join(DEFAULT_VISION_MODELS)).split(",") if m.strip()
+        ] or list(DEFAULT_VISION_MODELS)
+        # Дедлайн на одну vision-модель (вместе с ретраями). Кто не успел — не участвует в голосовании.
+        self.vision_deadline_s = float(os.getenv("VISION_MODEL_DEADLINE_S", "120"))
+        # Кворум: сколько моделей должны полностью совпасть по основным планетам обоих
+        # партнёров, чтобы не ждать остальные (не меньше 2 — один ответ ни с чем не сверен).
+        # 0 — всегда полное голосование.
+        quorum = int(os.getenv("VISION_QUORUM", "2"))
+        self.vision_quorum = max(2, quorum) if quorum > 0 else 0
+        if self.vision_quorum >= len(self.vision_models):
+            # Кворум из всех моделей ничего не отменяет — это обычное полное голосование
+            print(f"⚠️ VISION_QUORUM={self.vision_quorum} needs more than {len(self.vision_models)} vision models, "
+                  f"waiting for all of them")
+            self.vision_quorum = 0
+        # Доуточнение спорных/пропущенных полей коротким промптом (0 — выключено).
+        self.vision_requery_max_fields = int(os.getenv("VISION_REQUERY_MAX_FIELDS", "12"))
 
-    def _completion(self, messages, response_format=None, max_retries: int = 4):
-        """Единый вызов LLM с повторными попытками (на случай 429/временных сбоев)."""
-        last_error: Exception | None = None
+        self.cache = get_response_cache()
+        # Суммарный расход токенов (cached — сколько входных токенов провайдер взял из кэша префикса)
+        self.usage_totals = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        self.latency = _latency_tracker
+        self.providers = _provider_pool
 
-        for attempt in range(max_retries):
-            try:
-                kwargs = {
-                    "model": self.common_model,
-                    "messages": messages,
-                }
-                if response_format is not None:
-                    kwargs["response_format"] = response_format
+    def cache_stats(self) -> dict:
+        """Счётчики кэша ответов для мониторинга (пустой dict, если кэш выключен)."""
+        return self.cache.stats() if self.cache is not None else {}
 
-                return self.client.chat.completions.create(**kwargs)
-            except Exception as e:
-                last_error = e
-                sleep_s = min(8.0, 0.75 * (2**attempt))
-                print(f"⚠️ LLM request failed (attempt {attempt+1}/{max_retries}): {e}")
-                time.sleep(sleep_s)
+    def provider_stats(self) -> dict:
+        """Здоровье провайдеров: вызовы, доля ошибок, EWMA задержки по моделям, состояние цепи."""
+        return self.providers.stats()
 
-        raise last_error if last_error is not None else RuntimeError("LLM request failed")
+    def latency_stats(self) -> dict:
+        """Перцентили задержек по задачам/моделям и счётчики хеджирования."""
+        return self.latency.stats()
 
-    def _completion_model(self, model: str, messages, response_format=None, max_retries: int = 3):
-        last_error: Exception | None = None
+    def usage_stats(self) -> dict:
+        totals = dict(self.usage_totals)
+        prompt = totals["prompt_tokens"]
+        totals["cached_ratio"] = round(totals["cached_tokens"] / prompt, 3) if prompt else 0.0
+        return totals
 
-        for attempt in range(max_retries):
-            try:
-                kwargs = {
-                    "model": model,
-                    "messages": messages,
-                }
-                if response_format is not None:
-                    kwargs["response_format"] = response_format
-                return self.client.chat.completions.create(**kwargs)
-            except Exception as e:
-                last_error = e
-                sleep_s = min(6.0, 0.6 * (2**attempt))
-                print(f"⚠️ Vision model '{model}' failed (attempt {attempt+1}/{max_retries}): {e}")
-                time.sleep(sleep_s)
+    def _record_usage(self, model: str, usage) -> None:
+        """Лог входных токенов по вызову: сколько из них провайдер отдал из кэша префикса."""
+        if usage is None:
+            return
+        prompt = usage.prompt_tokens or 0
+        completion = usage.completion_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        self.usage_totals["calls"] += 1
+        self.usage_totals["prompt_tokens"] += prompt
+        self.usage_totals["cached_tokens"] += cached
+        self.usage_totals["completion_tokens"] += completion
+        print(f"📊 {model}: input {prompt} tokens (cached {cached}, uncached {prompt - cached}), output {completion}")
 
-        raise last_error if last_error is not None else RuntimeError("Vision request failed")
+    def _route(self, task: str) -> ModelRoute:
+        return self.routes.get(task) or self.routes["general"]
+
+    def _cached_response(self, model: str, messages, response_format, use_cache: bool, params: dict | None = None):
+        """Ищет ответ в кэше. Возвращает (ключ для сохранения или None, ответ или None)."""
+        if not use_cache or self.cache is None:
+            return None, None
+        try:
+            key = LLMResponseCache.make_key(model, messages, response_format, params)
+            payload = self.cache.get(key)
+            if payload is None:
+                return key, None
+            return key, ChatCompletion.model_validate_json(payload)
+        except Exception as e:
+            print(f"⚠️ LLM cache read failed: {e}")
+            return None, None
+
+    def _store_response(self, key: str | None, model: str, response, cache_if=None) -> None:
+        """Кладёт в кэш только полные непустые ответы (без обрыва по длине).
+        cache_if(response) — дополнительная проверка, что ответ годен для повторного использования."""
+        if key is None or self.cache is None:
+            return
+        try:
+            choice = response.choices[0]
+            if not choice.message.content or choice.finish_reason == "length":
+                return
+            if cache_if is not None and not cache_if(response):
+                return
+            self.cache.put(key, model, response.model_dump_json())
+        except Exception as e:
+            print(f"⚠️ LLM cache write failed: {e}")
 
     @staticmethod
     def _normalize_value(value):
@@ -88,12 +343,14 @@ class LLMService:
         Правило: по каждому полю берем наиболее частое непустое значение (majority vote).
         Если нет большинства — берем первое непустое.
         Аспекты объединяем по множеству.
+        Поля, где модели дали разные непустые значения, попадают в "disputed".
         """
         merged = {
             "client_1": {},
             "client_2": {},
             "aspects": [],
             "missing": {"client_1": [], "client_2": []},
+            "disputed": {"client_1": [], "client_2": []},
             "status": "Unknown",
         }
 
@@ -133,6 +390,9 @@ class LLMService:
                 for r in results:
                     vals.append((r.get(who) or {}).get(key))
                 merged[who][key] = pick_value(vals)
+                distinct = {self._normalize_value(v) for v in vals} - {None}
+                if len(distinct) > 1 and key not in ("name", "gender"):
+                    merged["disputed"][who].append(key)
 
         # aspects union
         aspect_set = set()
@@ -144,24 +404,17 @@ class LLMService:
                         aspect_set.add(aa)
         merged["aspects"] = sorted(aspect_set)
 
-        # recompute missing + status based on ">=5 planets" rule
-        core_planets = [
-            "sun",
-            "moon",
-            "mercury",
-            "venus",
-            "mars",
-            "jupiter",
-            "saturn",
-            "uranus",
-            "neptune",
-            "pluto",
-        ]
+        self._update_missing_status(merged)
+        return merged
 
+    def _update_missing_status(self, merged: dict) -> None:
+        """Пересчитывает missing и status по правилу ">=5 планет" у каждого партнёра."""
+        merged["missing"] = {"client_1": [], "client_2": []}
+        merged["status"] = "Unknown"
         for who in ("client_1", "client_2"):
             known = 0
             missing = []
-            for k in core_planets:
+            for k in CORE_PLANETS:
                 if self._normalize_value(merged[who].get(k)) is None:
                     missing.append(k)
                 else:
@@ -170,36 +423,265 @@ class LLMService:
             if known < 5:
                 merged["status"] = "NEEDS_CLEARER_IMAGE"
 
+    def _requery_fields(self, merged: dict) -> list[str]:
+        """Поля для доуточнения: спорные + пропущенные основные планеты ("client_2.venus")."""
+        fields = []
+        for who in ("client_1", "client_2"):
+            for key in merged.get("disputed", {}).get(who, []) + merged["missing"][who]:
+                field = f"{who}.{key}"
+                if field not in fields:
+                    fields.append(field)
+        return fields
+
+    def _apply_requery(self, merged: dict, fields: list[str], answer: dict) -> None:
+        """Вливает ответ доуточнения: непустое значение побеждает голосование."""
+        for field in fields:
+            who, key = field.split(".", 1)
+            value = self._normalize_value((answer.get(who) or {}).get(key))
+            if value is not None:
+                merged[who][key] = value
+        self._update_missing_status(merged)
+
+    def merge_screenshot_results(self, results: list[dict | None]) -> dict | None:
+        """Сливает распознавания нескольких скриншотов одной пары в один client_data.
+
+        Каждый скрин голосует одним уже слитым результатом; пустые поля не голосуют,
+        поэтому таблица планет с одного фото и сетка аспектов с другого просто
+        объединяются, а противоречия решаются большинством. Скрины, отбракованные
+        локальной проверкой качества, не участвуют, пока есть хоть один годный.
+        """
+        results = [r for r in results if r]
+        if len(results) <= 1:
+            return results[0] if results else None
+        usable = [r for r in results if not r.get("quality_issues")]
+        if not usable:
+            return results[0]
+        merged = self._merge_extractions(usable)
+        merged.pop("disputed", None)
         return merged
 
-    def extract_data_from_image(self, base64_image, prompt):
-        """Анализ изображения через Vision модели (majority vote)"""
-        try:
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}"
-                            }
+    def _core_signature(self, result: dict) -> tuple | None:
+        """Знаки основных планет обоих партнёров; None, если хоть одного нет."""
+        signature = []
+        for who in ("client_1", "client_2"):
+            client = result.get(who) or {}
+            for key in CORE_PLANETS:
+                value = self._normalize_value(client.get(key))
+                if value is None:
+                    return None
+                signature.append(str(value).casefold())
+        return tuple(signature)
+
+    def _quorum_reached(self, results: list[dict]) -> bool:
+        """True, если не меньше vision_quorum результатов полностью совпали по CORE_PLANETS."""
+        if self.vision_quorum <= 0:
+            return False
+        counts: dict[tuple, int] = {}
+        for r in results:
+            signature = self._core_signature(r)
+            if signature is None:
+                continue
+            counts[signature] = counts.get(signature, 0) + 1
+            if counts[signature] >= self.vision_quorum:
+                return True
+        return False
+
+    @staticmethod
+    def _image_messages(base64_image, prompt) -> list[dict]:
+        return [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{base64_image}"
                         }
-                    ]
-                }
+                    }
+                ]
+            }
+        ]
+
+    @staticmethod
+    def _report_messages(system_prompt, user_data, task_prompt) -> list[dict]:
+        """Сначала стабильный префикс (персона, задача с правилами и эталонами) — он байт-в-байт
+        одинаковый для всех пар и кэшируется провайдером; данные пары идут последними."""
+        task = f"ЗАДАЧА:\n{task_prompt}"
+        data = f"ДАННЫЕ КЛИЕНТОВ:\n{user_data}"
+        if not PROMPT_CACHE_CONTROL:
+            return [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": f"{task}\n\n{data}"},
             ]
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": [
+                # Метка ставится на конец стабильной части: кэшируется всё до неё включительно
+                {"type": "text", "text": task, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": data},
+            ]},
+        ]
+
+    @staticmethod
+    def _continuation_messages(messages: list[dict], kept_text: str, next_block: int) -> list[dict]:
+        """Исходный запрос + уже написанная часть отчёта + просьба дописать с блока next_block."""
+        return messages + [
+            {"role": "assistant", "content": kept_text},
+            {"role": "user", "content": CONTINUE_REPORT_PROMPT.format(next_block=next_block, total_blocks=TOTAL_BLOCKS)},
+        ]
+
+    @staticmethod
+    def _completion_from_text(model: str, text: str, finish_reason: str | None) -> ChatCompletion:
+        """Собирает ChatCompletion из текста, полученного стримом (для кэша)."""
+        return ChatCompletion.model_validate({
+            "id": "stream",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "finish_reason": finish_reason or "stop",
+                "message": {"role": "assistant", "content": text},
+            }],
+        })
+
+    def _usable_extraction(self, response) -> bool:
+        """Vision-ответ стоит кэшировать, только если он разобрался в JSON и это не NEEDS_CLEARER_IMAGE:
+        иначе повторная отправка того же скриншота мгновенно получила бы ту же неудачу."""
+        try:
+            parsed = self._parse_json_content(response.choices[0].message.content)
+        except ValueError:
+            return False
+        return parsed is not None and parsed.get("status") != "NEEDS_CLEARER_IMAGE"
+
+    @staticmethod
+    def _parse_json_content(content) -> dict | None:
+        """Разбирает JSON-ответ модели (Gemini может обернуть его в markdown)."""
+        if not content:
+            return None
+        content = content.replace("```json", "").replace("```", "").strip()
+        parsed = json.loads(content)
+        return parsed if isinstance(parsed, dict) else None
+
+
+class LLMService(BaseLLMService):
+    """Синхронный клиент (для скриптов и кода, который живёт вне event loop)."""
+
+    def __init__(self):
+        super().__init__()
+        # По OpenAI-клиенту на провайдера пула; self.client — первый (OpenRouter по умолчанию)
+        self._clients: dict[str, OpenAI] = {}
+        self.client = self._client_for(self.providers.providers[0])
+
+    def _client_for(self, provider: Provider) -> OpenAI:
+        client = self._clients.get(provider.name)
+        if client is None:
+            client = self._clients[provider.name] = OpenAI(
+                base_url=provider.base_url,
+                api_key=os.getenv(provider.api_key_env) if provider.api_key_env else "none",
+            )
+        return client
+
+    def _create(self, kwargs: dict, tried: set[str]):
+        """Запрос к самому здоровому провайдеру модели (по возможности не из tried);
+        исход и время ответа пишутся в здоровье провайдера."""
+        model = kwargs["model"]
+        provider = self.providers.pick(model, exclude=tried)
+        tried.add(provider.name)
+        started = time.monotonic()
+        try:
+            response = self._client_for(provider).chat.completions.create(
+                **{**kwargs, "model": provider.remote_model(model)}
+            )
+        except Exception as e:
+            self.providers.record_failure(provider, model, e)
+            raise
+        self.providers.record_success(provider, model, time.monotonic() - started)
+        return response
+
+    def _completion(self, messages, response_format=None, max_retries: int = 4, use_cache: bool = True, task: str = "report"):
+        """Единый вызов LLM с повторными попытками (на случай 429/временных сбоев).
+        Модель и параметры берутся из маршрута задачи task."""
+        route = self._route(task)
+        params = route.params()
+        cache_key, cached = self._cached_response(route.model, messages, response_format, use_cache, params)
+        if cached is not None:
+            return cached
+
+        last_error: Exception | None = None
+        tried: set[str] = set()
+
+        for attempt in range(max_retries):
+            try:
+                kwargs = {
+                    "model": route.model,
+                    "messages": messages,
+                    **params,
+                }
+                if response_format is not None:
+                    kwargs["response_format"] = response_format
+
+                response = self._create(kwargs, tried)
+                self._record_usage(route.model, response.usage)
+                self._store_response(cache_key, route.model, response)
+                return response
+            except ProviderUnavailableError:
+                raise
+            except Exception as e:
+                last_error = e
+                print(f"⚠️ LLM request failed (attempt {attempt+1}/{max_retries}): {e}")
+                if not self.providers.has_alternative(route.model, tried):
+                    time.sleep(min(8.0, 0.75 * (2**attempt)))
+
+        raise last_error if last_error is not None else RuntimeError("LLM request failed")
+
+    def _completion_model(self, model: str, messages, response_format=None, max_retries: int = 3, use_cache: bool = True,
+                          cache_if=None):
+        cache_key, cached = self._cached_response(model, messages, response_format, use_cache)
+        if cached is not None and (cache_if is None or cache_if(cached)):
+            return cached
+
+        last_error: Exception | None = None
+        tried: set[str] = set()
+
+        for attempt in range(max_retries):
+            try:
+                kwargs = {
+                    "model": model,
+                    "messages": messages,
+                }
+                if response_format is not None:
+                    kwargs["response_format"] = response_format
+                response = self._create(kwargs, tried)
+                self._record_usage(model, response.usage)
+                self._store_response(cache_key, model, response, cache_if)
+                return response
+            except ProviderUnavailableError:
+                raise
+            except Exception as e:
+                last_error = e
+                sleep_s = min(6.0, 0.6 * (2**attempt))
+                print(f"⚠️ Vision model '{model}' failed (attempt {attempt+1}/{max_retries}): {e}")
+                if not self.providers.has_alternative(model, tried):
+                    time.sleep(sleep_s)
+
+        raise last_error if last_error is not None else RuntimeError("Vision request failed")
+
+    def extract_data_from_image(self, base64_image, prompt):
+        """Анализ изображения через Vision модели (majority vote).
+
+        Метод блокирующий; бот использует AsyncLLMService, где распознавание отменяется через task.cancel().
+        """
+        try:
+            messages = self._image_messages(base64_image, prompt)
 
             parsed_results = []
             for model in self.vision_models:
                 try:
-                    response = self._completion_model(model, messages)
-                    content = response.choices[0].message.content
-                    if not content:
-                        continue
-                    content = content.replace("```json", "").replace("```", "").strip()
-                    parsed = json.loads(content)
-                    if isinstance(parsed, dict):
+                    response = self._completion_model(model, messages, cache_if=self._usable_extraction)
+                    parsed = self._parse_json_content(response.choices[0].message.content)
+                    if parsed is not None:
                         parsed_results.append(parsed)
                 except Exception as e:
                     print(f"Error extracting data from image with {model}: {e}")
@@ -208,7 +690,9 @@ class LLMService:
             if not parsed_results:
                 return None
 
-            return self._merge_extractions(parsed_results)
+            merged = self._merge_extractions(parsed_results)
+            merged.pop("disputed", None)
+            return merged
         except Exception as e:
             print(f"Error extracting data from image: {e}")
             return None
@@ -216,10 +700,7 @@ class LLMService:
     def generate_full_report(self, system_prompt, user_data, full_prompt):
         """Генерация полного отчета (всех блоков) за один проход"""
         try:
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"ДАННЫЕ КЛИЕНТОВ:\n{user_data}\n\nЗАДАЧА:\n{full_prompt}"}
-            ]
+            messages = self._report_messages(system_prompt, user_data, full_prompt)
             # Можно увеличить таймаут или макс токенов, если нужно
             response = self._completion(messages)
             return response.choices[0].message.content
@@ -230,10 +711,7 @@ class LLMService:
     def generate_block(self, system_prompt, user_data, block_prompt):
         """Генерация блока текста (Первичная)"""
         try:
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": f"ДАННЫЕ КЛИЕНТОВ:\n{user_data}\n\nЗАДАЧА:\n{block_prompt}"}
-            ]
+            messages = self._report_messages(system_prompt, user_data, block_prompt)
             response = self._completion(messages)
             return response.choices[0].message.content
         except Exception as e:
@@ -247,7 +725,7 @@ class LLMService:
                 {"role": "system", "content": "Ты строгий астрологический аудитор. Отвечай только в формате JSON."},
                 {"role": "user", "content": f"{verification_prompt}\n\nВОТ ДАННЫЕ:\n{user_data}\n\nВОТ ТЕКСТ НА ПРОВЕРКУ:\n{generated_text}"}
             ]
-            response = self._completion(messages, response_format={"type": "json_object"})
+            response = self._completion(messages, response_format={"type": "json_object"}, task="verify")
             content = response.choices[0].message.content
             if not content:
                 return {"status": "NEEDS_MANUAL_REVIEW", "critical_errors": [], "feedback": "Empty response from verifier"}
@@ -266,13 +744,13 @@ class LLMService:
                 {"role": "system", "content": "Ты профессиональный редактор."},
                 {"role": "user", "content": f"{style_prompt}\n\nТЕКСТ ДЛЯ РЕДАКТУРЫ:\n{text}"}
             ]
-            response = self._completion(messages)
+            response = self._completion(messages, task="style")
             return response.choices[0].message.content
         except Exception as e:
             print(f"Error styling text: {e}")
             return text
 
-    def run_prompt(self, system_prompt: str, user_prompt: str) -> str:
+    def run_prompt(self, system_prompt: str, user_prompt: str, task: str = "general") -> str:
         """Универсальный вызов LLM без предустановленного "редактора".
 
         Использовать для задач, где важны структура/формат (верстка, сборка),
@@ -283,7 +761,7 @@ class LLMService:
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
             ]
-            response = self._completion(messages)
+            response = self._completion(messages, task=task)
             content = response.choices[0].message.content
             return content if isinstance(content, str) else str(content)
         except Exception as e:
@@ -295,5 +773,458 @@ class LLMService:
         result = self.run_prompt(
             "Ты главный редактор.",
             f"{check_prompt}\n\nПОЛНЫЙ ТЕКСТ:\n{full_text}",
+            task="consistency",
+        )
+        return result if result else full_text
+
+
+class AsyncLLMService(BaseLLMService):
+    """Асинхронный вариант LLMService на общем пуле соединений.
+
+    Все экземпляры используют общие AsyncOpenAI (по одному на провайдера, см. get_async_client),
+    поэтому сотни параллельных запросов стоят корутин, а не потоков executor-а.
+    Каждый запрос уходит к самому здоровому провайдеру пула, обслуживающему модель.
+    """
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        return get_async_client()
+
+    async def _completion(self, messages, response_format=None, max_retries: int = 4, use_cache: bool = True, task: str = "report"):
+        """Единый вызов LLM с повторными попытками (на случай 429/временных сбоев).
+        Модель и параметры берутся из маршрута задачи task."""
+        route = self._route(task)
+        return await self._completion_model(
+            route.model,
+            messages,
+            response_format=response_format,
+            max_retries=max_retries,
+            base_sleep_s=0.75,
+            max_sleep_s=8.0,
+            use_cache=use_cache,
+            params=route.params(),
+            task=task,
+            hedge_model=route.hedge_model,
+        )
+
+    async def _completion_model(
+        self,
+        model: str,
+        messages,
+        response_format=None,
+        max_retries: int = 3,
+        base_sleep_s: float = 0.6,
+        max_sleep_s: float = 6.0,
+        use_cache: bool = True,
+        params: dict | None = None,
+        task: str | None = None,
+        hedge_model: str | None = None,
+        cache_if=None,
+    ):
+        """cache_if(response) — брать ответ из кэша и класть в кэш, только если он годен (см. _store_response)."""
+        # SQLite и sha256 по сообщениям (в них base64 картинок) — в потоке, не в event loop
+        cache_key, cached = await asyncio.to_thread(
+            self._cached_response, model, messages, response_format, use_cache, params
+        )
+        if cached is not None and (cache_if is None or cache_if(cached)):
+            return cached
+
+        last_error: Exception | None = None
+        tried: set[str] = set()
+
+        for attempt in range(max_retries):
+            try:
+                kwargs = {
+                    "model": model,
+                    "messages": messages,
+                    **(params or {}),
+                }
+                if response_format is not None:
+                    kwargs["response_format"] = response_format
+                used_model, response = await self._hedged_create(kwargs, task, hedge_model, tried)
+                self._record_usage(used_model, response.usage)
+                if used_model == model:
+                    await asyncio.to_thread(self._store_response, cache_key, model, response, cache_if)
+                return response
+            except ProviderUnavailableError:
+                # Модель не обслуживает ни один провайдер (конфигурация) — повторы ничего не дадут
+                raise
+            except Exception as e:
+                last_error = e
+                print(f"⚠️ LLM '{model}' failed (attempt {attempt+1}/{max_retries}): {e}")
+                if self.providers.has_alternative(model, tried):
+                    # Следующая попытка уйдёт к другому провайдеру — без паузы
+                    continue
+                await asyncio.sleep(min(max_sleep_s, base_sleep_s * (2**attempt)))
+
+        raise last_error if last_error is not None else RuntimeError("LLM request failed")
+
+    async def _timed_create(self, provider: Provider, kwargs: dict, task: str | None):
+        """Один запрос к провайдеру; исход и время ответа пишутся в здоровье провайдера
+        и гистограмму задачи/модели."""
+        model = kwargs["model"]
+        started = time.monotonic()
+        try:
+            response = await get_async_client(provider).chat.completions.create(
+                **{**kwargs, "model": provider.remote_model(model)}
+            )
+        except Exception as e:
+            self.providers.record_failure(provider, model, e)
+            raise
+        elapsed = time.monotonic() - started
+        self.providers.record_success(provider, model, elapsed)
+        self.latency.record(task, model, elapsed)
+        return model, response
+
+    async def _hedged_create(self, kwargs: dict, task: str | None, hedge_model: str | None, tried: set[str]):
+        """Запрос с хеджированием хвостовых задержек. Возвращает (модель ответа, ответ).
+
+        Если ответа нет дольше перцентиля задержек (task, model), параллельно уходит дубль
+        на hedge_model (или ту же модель), по возможности к другому провайдеру; берётся первый
+        успешный ответ, второй запрос отменяется.
+        Пока замеров мало (или LLM_HEDGE_ENABLED=0) — обычный одиночный запрос.
+        tried — провайдеры, уже опробованные в этом вызове (пополняется).
+        """
+        model = kwargs["model"]
+        provider = self.providers.pick(model, exclude=tried)
+        tried.add(provider.name)
+        delay = self.latency.hedge_delay(task, model) if LLM_HEDGE_ENABLED else None
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._timed_create(provider, kwargs, task))
+        pending = {primary}
+        try:
+            if delay is None:
+                return await primary
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            hedge_kwargs = {**kwargs, "model": hedge_model or model}
+            hedge_provider = self.providers.pick(hedge_kwargs["model"], exclude={provider.name})
+            print(
+                f"⏱️ LLM '{model}' [{task or 'direct'}] slower than {delay:.1f}s, "
+                f"hedging with '{hedge_kwargs['model']}' via {hedge_provider.name}"
+            )
+            hedge = asyncio.ensure_future(self._timed_create(hedge_provider, hedge_kwargs, task))
+            pending = {primary, hedge}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for finished in done:
+                    if finished.exception() is None:
+                        self.latency.note_hedge(won=finished is hedge)
+                        if finished is hedge and not primary.done():
+                            # Основной запрос отменяется, но его хвост нужен гистограмме:
+                            # пишем, сколько он уже прождал (нижняя оценка его задержки)
+                            self.latency.record(task, model, time.monotonic() - started)
+                        return finished.result()
+            # Оба запроса упали — наружу ошибка основного, как без хеджирования
+            return primary.result()
+        finally:
+            for leftover in pending:
+                leftover.cancel()
+
+    async def _extract_with_model(self, model: str, messages) -> dict | None:
+        """Один vision-запрос с дедлайном; ошибка или таймаут -> None."""
+        try:
+            response = await asyncio.wait_for(
+                self._completion_model(model, messages, cache_if=self._usable_extraction),
+                timeout=self.vision_deadline_s,
+            )
+            return self._parse_json_content(response.choices[0].message.content)
+        except asyncio.TimeoutError:
+            print(f"⚠️ Vision model '{model}' missed the {self.vision_deadline_s:g}s deadline")
+            return None
+        except Exception as e:
+            print(f"Error extracting data from image with {model}: {e}")
+            return None
+
+    async def extract_data_from_image(self, base64_image, prompt):
+        """Анализ изображения через Vision модели (majority vote).
+
+        Модели опрашиваются параллельно, каждая со своим дедлайном; голосование
+        идёт по тем результатам, что успели прийти. Как только набирается кворум
+        (vision_quorum полностью совпавших ответов), остальные запросы отменяются.
+        Отмена — обычный task.cancel().
+        """
+        try:
+            messages = self._image_messages(base64_image, prompt)
+
+            tasks = [
+                asyncio.create_task(self._extract_with_model(model, messages))
+                for model in self.vision_models
+            ]
+            parsed_results = []
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    result = await next_done
+                    if result is None:
+                        continue
+                    parsed_results.append(result)
+                    if len(parsed_results) < len(tasks) and self._quorum_reached(parsed_results):
+                        print(f"✅ Vision quorum reached after {len(parsed_results)}/{len(tasks)} models")
+                        break
+            finally:
+                for task in tasks:
+                    if not task.done():
+                        task.cancel()
+
+            if not parsed_results:
+                return None
+
+            merged = self._merge_extractions(parsed_results)
+            await self._requery_disputed(merged, base64_image)
+            merged.pop("disputed", None)
+            return merged
+        except Exception as e:
+            print(f"Error extracting data from image: {e}")
+            return None
+
+    async def extract_data_from_regions(self, base64_image, regions) -> dict | None:
+        """Распознавание по фрагментам (таблицы планет / сетка аспектов) параллельно.
+
+        regions — список image_tools.ImageRegion. Каждый фрагмент уходит во все
+        vision-модели с коротким профильным промптом; частичные JSON сливаются
+        тем же _merge_extractions (голосование по непустым значениям), спорное
+        и пропущенное доуточняется по полной картинке base64_image.
+        """
+        try:
+            calls = [
+                self._extract_region(model, region)
+                for region in regions
+                for model in self.vision_models
+            ]
+            parsed_results = [r for r in await asyncio.gather(*calls) if r is not None]
+            if not parsed_results:
+                return None
+
+            merged = self._merge_extractions(parsed_results)
+            await self._requery_disputed(merged, base64_image)
+            merged.pop("disputed", None)
+            return merged
+        except Exception as e:
+            print(f"Error extracting data from image regions: {e}")
+            return None
+
+    async def _extract_region(self, model: str, region) -> dict | None:
+        """Один фрагмент одной моделью. Таблица одного партнёра сама не говорит, чей она:
+        партнёр берётся из положения фрагмента (region.partner) — и в промпт, и в ответ."""
+        if region.kind == "aspects":
+            messages = self._image_messages(region.base64, ASPECT_GRID_EXTRACTION_PROMPT)
+            return await self._extract_with_model(model, messages)
+        prompt = PLANET_TABLE_EXTRACTION_PROMPT
+        if region.partner is not None:
+            prompt += PLANET_TABLE_PARTNER_HINT.format(
+                position="левая/верхняя" if region.partner == 1 else "правая/нижняя",
+                client=f"client_{region.partner}",
+            )
+        result = await self._extract_with_model(model, self._image_messages(region.base64, prompt))
+        if result is None or region.partner is None:
+            return result
+
+        def filled(client: str) -> int:
+            data = result.get(client)
+            return sum(1 for v in data.values() if self._normalize_value(v) is not None) if isinstance(data, dict) else 0
+
+        target = f"client_{region.partner}"
+        other = "client_2" if region.partner == 1 else "client_1"
+        if filled(other) and filled(target):
+            # На фрагменте оба партнёра — раскладка определена неверно, голос фрагмента не берём
+            print(f"⚠️ Planet tile {region.box} holds both partners, ignoring {model} answer")
+            return None
+        # Модель могла всё равно записать таблицу под client_1 — переносим под нужного партнёра
+        if filled(other):
+            return {**result, target: result[other], other: {}}
+        return result
+
+    async def _requery_disputed(self, merged: dict, base64_image) -> None:
+        """Переспрашивает только спорные/пропущенные поля вместо повторного полного распознавания."""
+        fields = self._requery_fields(merged)
+        if not fields or len(fields) > self.vision_requery_max_fields:
+            return
+        print(f"🔎 Re-querying {len(fields)} field(s): {', '.join(fields)}")
+        messages = self._image_messages(base64_image, FIELD_REQUERY_PROMPT.format(fields="\n".join(fields)))
+        answer = await self._extract_with_model(self.vision_models[0], messages)
+        if answer:
+            self._apply_requery(merged, fields, answer)
+
+    async def generate_full_report(self, system_prompt, user_data, full_prompt):
+        """Генерация полного отчета (всех блоков) за один проход.
+
+        Если ответ оборвался по лимиту токенов или в нём не хватает блоков,
+        дописывается хвост (до REPORT_MAX_CONTINUATIONS запросов-продолжений).
+        """
+        try:
+            messages = self._report_messages(system_prompt, user_data, full_prompt)
+            response = await self._completion(messages)
+            text = response.choices[0].message.content or ""
+            finish_reason = response.choices[0].finish_reason
+            for _ in range(REPORT_MAX_CONTINUATIONS):
+                resume = continuation_point(text, finish_reason == "length")
+                if resume is None:
+                    break
+                kept, next_block = resume
+                print(f"↪️ Report incomplete (finish_reason={finish_reason}), continuing from block {next_block}")
+                response = await self._completion(self._continuation_messages(messages, kept, next_block))
+                tail = response.choices[0].message.content or ""
+                finish_reason = response.choices[0].finish_reason
+                text = kept + (strip_to_block(tail, next_block) or f"{block_header(next_block)}\n{tail.lstrip()}")
+            return text
+        except Exception as e:
+            print(f"Error generating full report: {e}")
+            return f"Ошибка генерации полного отчета: {e}"
+
+    async def _stream_into(self, provider: Provider, model: str, messages: list[dict], parser: BlockStreamParser, emit, start_block: int | None = None) -> str | None:
+        """Один стрим-запрос к провайдеру: текст дописывается в parser, готовые секции отдаются в emit.
+
+        start_block — запрос-продолжение: всё до заголовка "=== БЛОК start_block ==="
+        (вступления, повторы прошлых блоков) отбрасывается. Возвращает finish_reason.
+        """
+        try:
+            finish_reason = await self._read_stream(provider, model, messages, parser, emit, start_block)
+        except Exception as e:
+            self.providers.record_failure(provider, model, e)
+            raise
+        # Длительность стрима зависит от объёма текста, в EWMA задержки её не пишем
+        self.providers.record_success(provider, model)
+        return finish_reason
+
+    async def _read_stream(self, provider: Provider, model: str, messages: list[dict], parser: BlockStreamParser, emit, start_block: int | None) -> str | None:
+        pending = "" if start_block is not None else None
+        finish_reason = None
+        stream = await get_async_client(provider).chat.completions.create(
+            model=provider.remote_model(model),
+            messages=messages,
+            stream=True,
+            stream_options={"include_usage": True},
+            **self._route("report").params(),
+        )
+        async for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                self._record_usage(model, chunk.usage)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            content = choice.delta.content if choice.delta is not None else None
+            if content and pending is not None:
+                pending += content
+                content = strip_to_block(pending, start_block)
+                if content is not None:
+                    pending = None
+            if content:
+                await emit(parser.feed(content))
+            if choice.finish_reason:
+                finish_reason = choice.finish_reason
+        if pending and pending.strip():
+            # Модель продолжила без заголовка — ставим его сами
+            await emit(parser.feed(f"{block_header(start_block)}\n{pending.lstrip()}"))
+        return finish_reason
+
+    async def generate_full_report_stream(self, system_prompt, user_data, full_prompt, on_block=None, max_retries: int = 4):
+        """Потоковая генерация полного отчета.
+
+        Текст читается стримом; как только секция закончилась (начался следующий
+        "=== БЛОК N ==="), вызывается корутина on_block(n, text), вводная — n=0.
+        Повтор запроса возможен, только пока в этом запросе ни одна секция не отдана наружу.
+        Оборванный по лимиту (или недописанный) отчёт продолжается так же, как в generate_full_report:
+        последний неполный блок ещё не отдан в on_block, поэтому просто пишется заново.
+        Результат кэшируется так же, как у generate_full_report.
+        """
+        route = self._route("report")
+        model = route.model
+        messages = self._report_messages(system_prompt, user_data, full_prompt)
+        cache_key, cached = await asyncio.to_thread(
+            self._cached_response, model, messages, None, True, route.params()
+        )
+        if cached is not None:
+            text = cached.choices[0].message.content
+            if on_block is not None:
+                for n, section in split_report_blocks(text):
+                    await on_block(n, section)
+            return text
+
+        parser = BlockStreamParser()
+        emitted = 0
+
+        async def emit(sections):
+            nonlocal emitted
+            for n, section in sections:
+                emitted += 1
+                if on_block is not None:
+                    await on_block(n, section)
+
+        request = messages
+        start_block = None
+        finish_reason = None
+        for continuation in range(REPORT_MAX_CONTINUATIONS + 1):
+            last_error: Exception | None = None
+            tried: set[str] = set()
+            for attempt in range(max_retries):
+                mark, emitted_before = len(parser.text), emitted
+                try:
+                    provider = self.providers.pick(model, exclude=tried)
+                    tried.add(provider.name)
+                    finish_reason = await self._stream_into(provider, model, request, parser, emit, start_block)
+                    last_error = None
+                    break
+                except ProviderUnavailableError as e:
+                    last_error = e
+                    break
+                except Exception as e:
+                    if emitted != emitted_before:
+                        print(f"Error streaming full report after partial output: {e}")
+                        return f"Ошибка генерации полного отчета: {e}"
+                    parser.truncate(mark)
+                    last_error = e
+                    print(f"⚠️ LLM stream '{model}' failed (attempt {attempt+1}/{max_retries}): {e}")
+                    if not self.providers.has_alternative(model, tried):
+                        await asyncio.sleep(min(8.0, 0.75 * (2**attempt)))
+            if last_error is not None:
+                print(f"Error generating full report: {last_error}")
+                return f"Ошибка генерации полного отчета: {last_error}"
+
+            resume = continuation_point(parser.text, finish_reason == "length")
+            if resume is None or continuation == REPORT_MAX_CONTINUATIONS:
+                break
+            kept, start_block = resume
+            print(f"↪️ Report incomplete (finish_reason={finish_reason}), continuing from block {start_block}")
+            parser.truncate(len(kept))
+            request = self._continuation_messages(messages, kept, start_block)
+
+        await emit(parser.finish())
+        await asyncio.to_thread(
+            self._store_response, cache_key, model, self._completion_from_text(model, parser.text, finish_reason)
+        )
+        return parser.text
+
+    async def generate_block(self, system_prompt, user_data, block_prompt):
+        """Генерация блока текста (Первичная)"""
+        try:
+            messages = self._report_messages(system_prompt, user_data, block_prompt)
+            response = await self._completion(messages)
+            return response.choices[0].message.content
+        except Exception as e:
+            print(f"Error generating block: {e}")
+            return f"Ошибка генерации блока: {e}"
+
+    async def run_prompt(self, system_prompt: str, user_prompt: str, task: str = "general") -> str:
+        """Универсальный вызов LLM без предустановленного "редактора"."""
+        try:
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ]
+            response = await self._completion(messages, task=task)
+            content = response.choices[0].message.content
+            return content if isinstance(content, str) else str(content)
+        except Exception as e:
+            print(f"Error running prompt: {e}")
+            return ""
+
+    async def consistency_check(self, full_text: str, check_prompt: str) -> str:
+        """Финальная проверка на противоречия/склейки (без изменения формата)."""
+        result = await self.run_prompt(
+            "Ты главный редактор.",
+            f"{check_prompt}\n\nПОЛНЫЙ ТЕКСТ:\n{full_text}",
+            task="consistency",
         )
         return result if result else full_text
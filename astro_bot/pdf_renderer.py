@@ -1,11 +1,11 @@
 import os
 import re
-from typing import Any, Dict
+from typing import Any, Dict, List
 from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.units import cm
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Flowable
 from reportlab.pdfbase import pdfmetrics
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib.enums import TA_CENTER, TA_JUSTIFY, TA_LEFT
@@ -212,17 +212,15 @@ class PDFReportGenerator:
 
     def create_pdf(self, client_data: Dict[str, Any], full_text: str) -> str:
         """Генерация PDF документа"""
-        story = []
-        
-        # --- Титульная страница ---
-        # Делаем её через onFirstPage, чтобы баннер был на всю ширину,
-        # а заголовок был поверх баннера (как на скриншоте).
+        return self.build_pdf(client_data, self.markup_to_flowables(full_text))
 
-        # Баннер рисуется прямо на canvas, поэтому story должен начать контент ниже баннера.
-        cover_banner_h = 2 * cm
-        cover_gap_h = 1.5 * cm
-        story.append(Spacer(1, cover_banner_h + cover_gap_h - 15))
+    def markup_to_flowables(self, full_text: str) -> List[Flowable]:
+        """Конвертация AstroMarkup (весь отчёт или один блок) во flowables ReportLab.
 
+        Не зависит от соседних блоков, поэтому блоки можно конвертировать
+        по мере готовности и склеить списки перед build_pdf.
+        """
+        story = []
 
         # --- Основной контент ---
         # Парсим текст, пытаясь найти заголовки блоков
@@ -317,6 +315,20 @@ class PDFReportGenerator:
 
                 story.append(Paragraph(line, self.styles['BodyTextCustom']))
 
+        return story
+
+    def build_pdf(self, client_data: Dict[str, Any], flowables: List[Flowable]) -> str:
+        """Сборка PDF из готовых flowables (титульная + контент)."""
+        # --- Титульная страница ---
+        # Делаем её через onFirstPage, чтобы баннер был на всю ширину,
+        # а заголовок был поверх баннера (как на скриншоте).
+
+        # Баннер рисуется прямо на canvas, поэтому story должен начать контент ниже баннера.
+        cover_banner_h = 2 * cm
+        cover_gap_h = 1.5 * cm
+        story = [Spacer(1, cover_banner_h + cover_gap_h - 15)]
+        story.extend(flowables)
+
         # --- Генерация ---
         doc = SimpleDocTemplate(
             self.output_filename,
@@ -0,0 +1,159 @@
+import argparse
+import hashlib
+import re
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+
+import prompts
+from context_encoder import estimate_tokens
+
+# Из каких шаблонов собирается каждый запрос к LLM (system + user без данных пары)
+REQUEST_PROFILES = {
+    "full_report": ["MAIN_PERSONA", "FULL_REPORT_PROMPT"],
+    **{f"block_{n}": ["MAIN_PERSONA", f"BLOCK_PROMPTS[{n}]"] for n in sorted(prompts.BLOCK_PROMPTS)},
+    "intro": ["MAIN_PERSONA", "INTRO_PROMPT"],
+    "block_layout": ["BLOCK_LAYOUT_PROMPT"],
+    "refine": ["REFINE_REPORT_PROMPT"],
+    "refine_block": ["REFINE_BLOCK_PROMPT"],
+    "consistency_check": ["CONSISTENCY_CHECK_PROMPT"],
+    "image_extraction": ["IMAGE_EXTRACTION_PROMPT"],
+}
+
+
+@dataclass(frozen=True)
+class PromptInfo:
+    name: str
+    text: str
+    sha256: str
+    tokens: int
+
+    @property
+    def version(self) -> str:
+        return self.sha256[:12]
+
+    @property
+    def chars(self) -> int:
+        return len(self.text)
+
+
+def _paragraphs(text: str, min_chars: int) -> list[str]:
+    paras = (re.sub(r"\s+", " ", p).strip() for p in re.split(r"\n\s*\n", text))
+    return [p for p in paras if len(p) >= min_chars]
+
+
+class PromptRegistry:
+    """Все строковые шаблоны из prompts.py, собранные один раз: хэш/версия и оценка токенов.
+
+    Инструмент разработки (python prompt_registry.py --check): бот шаблоны отсюда не читает,
+    они импортируются из prompts.py напрямую.
+    """
+
+    def __init__(self, module=prompts):
+        self.prompts: dict[str, PromptInfo] = {}
+        for name in sorted(vars(module)):
+            if not name.isupper():
+                continue
+            value = getattr(module, name)
+            if isinstance(value, str):
+                self._add(name, value)
+            elif isinstance(value, dict) and value and all(isinstance(v, str) for v in value.values()):
+                for key in sorted(value):
+                    self._add(f"{name}[{key}]", value[key])
+
+    def _add(self, name: str, text: str) -> None:
+        self.prompts[name] = PromptInfo(
+            name=name,
+            text=text,
+            sha256=hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            tokens=estimate_tokens(text),
+        )
+
+    def get(self, name: str) -> str:
+        return self.prompts[name].text
+
+    def version(self, name: str) -> str:
+        return self.prompts[name].version
+
+    def request_tokens(self, profile: str) -> int:
+        return sum(self.prompts[name].tokens for name in REQUEST_PROFILES[profile] if name in self.prompts)
+
+    def duplicated_paragraphs(self, min_chars: int = 80) -> list[tuple[str, list[str], str | None]]:
+        """Абзацы, встречающиеся в нескольких шаблонах: (абзац, шаблоны, источник).
+
+        Источник — шаблон, целиком вставленный в остальные (осознанная композиция, как BLOCK_RULES
+        в FULL_REPORT_PROMPT). None — абзац скопирован вручную: кандидат на вынос в константу.
+        """
+        holders: dict[str, list[str]] = {}
+        for info in self.prompts.values():
+            for para in dict.fromkeys(_paragraphs(info.text, min_chars)):
+                holders.setdefault(para, []).append(info.name)
+
+        result = []
+        for para, names in holders.items():
+            if len(names) < 2:
+                continue
+            source = next(
+                (
+                    n for n in names
+                    if all(self.prompts[n].text.strip() in self.prompts[o].text for o in names if o != n)
+                ),
+                None,
+            )
+            result.append((para, names, source))
+        return result
+
+
+@lru_cache(maxsize=1)
+def get_registry() -> PromptRegistry:
+    return PromptRegistry()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Размер и дубли шаблонов из prompts.py")
+    parser.add_argument("--budget", type=int, default=0, help="лимит токенов на запрос (0 — без проверки)")
+    parser.add_argument("--min-paragraph", type=int, default=80, help="минимальная длина абзаца для поиска дублей")
+    parser.add_argument("--check", action="store_true", help="код возврата 1 при превышении лимита или копипасте")
+    args = parser.parse_args(argv)
+
+    registry = get_registry()
+    print(f"{'PROMPT':<32} {'VERSION':<12} {'CHARS':>8} {'TOKENS':>8}")
+    for info in sorted(registry.prompts.values(), key=lambda i: -i.tokens):
+        print(f"{info.name:<32} {info.version:<12} {info.chars:>8} {info.tokens:>8}")
+
+    print(f"\n{'REQUEST':<32} {'TOKENS':>8}  (без данных пары)")
+    over_budget = []
+    for profile in REQUEST_PROFILES:
+        tokens = registry.request_tokens(profile)
+        flag = ""
+        if args.budget and tokens > args.budget:
+            over_budget.append(profile)
+            flag = f"  > budget {args.budget}"
+        print(f"{profile:<32} {tokens:>8}{flag}")
+
+    duplicates = registry.duplicated_paragraphs(args.min_paragraph)
+    embedded: dict[str, int] = {}
+    copies = []
+    for para, names, source in duplicates:
+        if source:
+            embedded[source] = embedded.get(source, 0) + 1
+        else:
+            copies.append((para, names))
+
+    if embedded:
+        print("\nEMBEDDED TEMPLATES (paragraphs reused by composition):")
+        for source, count in sorted(embedded.items()):
+            users = sorted({n for _, names, s in duplicates if s == source for n in names} - {source})
+            print(f"- {source}: {count} paragraph(s) in {', '.join(users)}")
+    if copies:
+        print("\nCOPY-PASTED PARAGRAPHS (candidates for a shared constant):")
+        for para, names in copies:
+            print(f"- {', '.join(names)}: {para[:90]}{'…' if len(para) > 90 else ''}")
+
+    if args.check and (over_budget or copies):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -462,23 +462,8 @@ BLOCK_PROMPTS = {
 """
 }
 
-FULL_REPORT_PROMPT = f"""
-ТЫ — ПРОФЕССИОНАЛЬНЫЙ АСТРОЛОГ. ТВОЯ ЗАДАЧА — НАПИСАТЬ ПОЛНЫЙ ОТЧЕТ О СОВМЕСТИМОСТИ.
-Твоя цель — создать максимально глубокий, психологичный и точный разбор, строго следуя предоставленным данным и эталонам стиля.
-
-ОБЩИЕ ПРАВИЛА И ЗАПРЕТЫ:
-{BLOCK_RULES}
-
-СТРУКТУРА ОТЧЕТА:
-Отчет должен начинаться с ВВОДНОЙ СЕКЦИИ (список планет), затем идут 7 основных смысловых блоков.
-Каждый смысловой блок должен начинаться с заголовка: "=== БЛОК N ===". 
-Внутри блока следуй структуре соответствующего ЭТАЛОНА.
-
-ВОТ ИНСТРУКЦИИ И ЭТАЛОНЫ ДЛЯ КАЖДОГО БЛОКА:
-
---- 0. ВВОДНАЯ СЕКЦИЯ: СПИСОК ПЛАНЕТ ---
-СРАЗУ В НАЧАЛЕ ОТВЕТА (перед блоком 1) выведи техническую информацию о партнерах.
-ВАЖНО: Выведи ТОЛЬКО первые 8 планет (Солнце, Луна, Меркурий, Венера, Марс, Юпитер, Сатурн, Уран). 
+# Формат вводной секции (список планет) — общий для FULL_REPORT_PROMPT и INTRO_PROMPT
+INTRO_SECTION_FORMAT = """ВАЖНО: Выведи ТОЛЬКО первые 8 планет (Солнце, Луна, Меркурий, Венера, Марс, Юпитер, Сатурн, Уран). 
 Остальные (Нептун, Плутон, Лилит, Раху, Асцендент) НЕ ВЫВОДИ в список.
 
 ФОРМАТ ВВОДНОЙ СЕКЦИИ:
@@ -502,7 +487,25 @@ FULL_REPORT_PROMPT = f"""
 Марс — <Знак>
 Юпитер — <Знак>
 Сатурн — <Знак>
-Уран — <Знак>
+Уран — <Знак>"""
+
+FULL_REPORT_PROMPT = f"""
+ТЫ — ПРОФЕССИОНАЛЬНЫЙ АСТРОЛОГ. ТВОЯ ЗАДАЧА — НАПИСАТЬ ПОЛНЫЙ ОТЧЕТ О СОВМЕСТИМОСТИ.
+Твоя цель — создать максимально глубокий, психологичный и точный разбор, строго следуя предоставленным данным и эталонам стиля.
+
+ОБЩИЕ ПРАВИЛА И ЗАПРЕТЫ:
+{BLOCK_RULES}
+
+СТРУКТУРА ОТЧЕТА:
+Отчет должен начинаться с ВВОДНОЙ СЕКЦИИ (список планет), затем идут 7 основных смысловых блоков.
+Каждый смысловой блок должен начинаться с заголовка: "=== БЛОК N ===". 
+Внутри блока следуй структуре соответствующего ЭТАЛОНА.
+
+ВОТ ИНСТРУКЦИИ И ЭТАЛОНЫ ДЛЯ КАЖДОГО БЛОКА:
+
+--- 0. ВВОДНАЯ СЕКЦИЯ: СПИСОК ПЛАНЕТ ---
+СРАЗУ В НАЧАЛЕ ОТВЕТА (перед блоком 1) выведи техническую информацию о партнерах.
+{INTRO_SECTION_FORMAT}
 
 --- БЛОК 1: ОБЩАЯ КАРТИНА ---
 Задача: Описать фундамент связи, стихии, главные синастрические аспекты.
@@ -549,6 +552,14 @@ FULL_REPORT_PROMPT = f"""
 НАЧИНАЙ ОТЧЕТ.
 """
 
+# Вводная секция отдельным запросом (параллельная генерация по блокам)
+INTRO_PROMPT = f"""ВВОДНАЯ СЕКЦИЯ: СПИСОК ПЛАНЕТ.
+Выведи техническую информацию о партнерах по входным данным.
+{INTRO_SECTION_FORMAT}
+
+Верни ТОЛЬКО вводную секцию: без блоков, заголовков "=== БЛОК N ===", вступлений и комментариев.
+"""
+
 VERIFICATION_PROMPT = """
 Слушай внимательно. Ты получаешь две вещи:
 1) JSON с распознанными данными пары: знаки планет/точки и список аспектов (aspects).
@@ -994,6 +1005,18 @@ FINAL_LAYOUT_PROMPT = """
 ВЕРНИ ТОЛЬКО РАЗМЕЧЕННЫЙ ТЕКСТ.
 """
 
+# Вёрстка одного блока, пока остальные ещё пишутся: те же правила, но без шапки отчёта.
+BLOCK_LAYOUT_PROMPT = FINAL_LAYOUT_PROMPT + """
+ВАЖНО: перед тобой ОДИН фрагмент отчёта (вводная со списком планет или один блок "=== БЛОК N ===").
+Размечай только его. Не добавляй [TITLE]/[SUBTITLE], вступлений, итогов и текста других блоков.
+"""
+
+# Продолжение отчёта, оборванного по лимиту токенов (после assistant-сообщения с уже написанной частью)
+CONTINUE_REPORT_PROMPT = """
+Ответ оборвался. Продолжи отчет с блока {next_block} и допиши все оставшиеся блоки до {total_blocks} включительно.
+Начни сразу с заголовка "=== БЛОК {next_block} ===". Не повторяй уже написанные блоки, не добавляй вступлений и пояснений.
+"""
+
 REFINE_REPORT_PROMPT = """
 Ты — профессиональный астролог-редактор.
 У тебя есть готовый текст отчета о совместимости (CURRENT_REPORT) и пожелание пользователя по его исправлению (USER_FEEDBACK).
@@ -1010,3 +1033,70 @@ CURRENT_REPORT:
 USER_FEEDBACK:
 {user_feedback}
 """
+
+REFINE_BLOCK_PROMPT = """
+Ты — профессиональный астролог-редактор.
+У тебя есть ОДИН фрагмент отчета о совместимости (CURRENT_BLOCK) и пожелание пользователя по исправлению отчета (USER_FEEDBACK).
+Остальные блоки отчета не меняются и тебе не показываются.
+
+Твоя задача:
+1. Внести в этот фрагмент правки, которые относятся к нему, СТРОГО следуя пожеланию пользователя.
+2. Если фрагмент начинается с заголовка "=== БЛОК N ===", сохрани этот заголовок без изменений.
+3. Не придумывай новые астрологические данные, если пользователь этого не просил.
+4. Верни ПОЛНЫЙ обновленный текст ТОЛЬКО этого фрагмента, без пояснений.
+
+CURRENT_BLOCK:
+{current_block}
+
+USER_FEEDBACK:
+{user_feedback}
+"""
+
+FIELD_REQUERY_PROMPT = """
+Ты — аналитик данных. Перед тобой то же изображение таблицы синастрии, что уже распознавалось.
+Большая часть данных уже считана. Нужно уточнить ТОЛЬКО следующие поля:
+{fields}
+
+Формат поля: client_N.planet, где client_1 и client_2 — те же два партнёра, что и в основной таблице
+(обычно левая/правая колонки или верхняя/нижняя строки).
+Для каждого поля внимательно посмотри на таблицу и выпиши ЗНАК ЗОДИАКА на русском языке
+(Овен, Телец, Близнецы, Рак, Лев, Дева, Весы, Скорпион, Стрелец, Козерог, Водолей, Рыбы).
+Если значение действительно не видно — пиши null. Не выдумывай.
+
+ВЕРНИ ТОЛЬКО VALID JSON, только с запрошенными полями, например:
+{{"client_1": {{"venus": "Телец"}}, "client_2": {{"mars": null}}}}
+"""
+
+PLANET_TABLE_EXTRACTION_PROMPT = """
+Ты — аналитик данных. Перед тобой ФРАГМЕНТ скриншота синастрии: таблица (или её часть) с позициями планет.
+Выпиши ЗНАК ЗОДИАКА для каждой планеты, которая видна на фрагменте, на русском языке
+(Овен, Телец, Близнецы, Рак, Лев, Дева, Весы, Скорпион, Стрелец, Козерог, Водолей, Рыбы).
+
+Партнёры: client_1 — первый/левый/верхний (или «Вы», Partner 1, синий цвет),
+client_2 — второй/правый/нижний (или «Партнёр», Partner 2, красный цвет).
+Если на фрагменте только один партнёр — заполни только его по подписи/цвету.
+Всё, чего на фрагменте нет, — null. Не выдумывай.
+
+ВЕРНИ ТОЛЬКО VALID JSON:
+{
+    "client_1": {"name": null, "sun": null, "moon": null, "mercury": null, "venus": null, "mars": null, "jupiter": null, "saturn": null, "uranus": null, "neptune": null, "pluto": null, "lilith": null, "north_node": null, "ascendant": null},
+    "client_2": {"name": null, "sun": null, "moon": null, "mercury": null, "venus": null, "mars": null, "jupiter": null, "saturn": null, "uranus": null, "neptune": null, "pluto": null, "lilith": null, "north_node": null, "ascendant": null}
+}
+"""
+
+# Добавляется к PLANET_TABLE_EXTRACTION_PROMPT, когда по раскладке скриншота известно, чья это таблица
+PLANET_TABLE_PARTNER_HINT = """
+На скриншоте две таблицы планет, этот фрагмент — {position} из них: это таблица {client}.
+Заполни только {client}, другого партнёра оставь null.
+"""
+
+ASPECT_GRID_EXTRACTION_PROMPT = """
+Ты — аналитик данных. Перед тобой ФРАГМЕНТ скриншота синастрии: сетка (таблица) аспектов между планетами пары.
+Выпиши все аспекты, которые видны в сетке, в формате
+"Планета (Partner 1) Аспект Планета (Partner 2)", например "Sun (Partner 1) Sextile Moon (Partner 2)".
+Названия планет и аспектов — на английском (Conjunction, Opposition, Square, Trine, Sextile, Quincunx).
+Не выдумывай аспекты, которых нет в сетке.
+
+ВЕРНИ ТОЛЬКО VALID JSON:
+{"aspects": ["Sun (Partner 1) Sextile Moon (Partner 2)"]}
+"""
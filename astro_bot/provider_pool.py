@@ -0,0 +1,188 @@
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+import httpx
+import openai
+
+
+class ProviderUnavailableError(RuntimeError):
+    """Модель не обслуживает ни один провайдер пула (ошибка конфигурации LLM_PROVIDERS)."""
+
+
+def is_provider_failure(exc: BaseException) -> bool:
+    """Ошибка на стороне провайдера: 5xx, таймаут, обрыв соединения.
+
+    4xx (кривой запрос, 429 на одной модели, нет доступа к модели) — не повод
+    считать эндпоинт нездоровым.
+    """
+    status = getattr(exc, "status_code", None)
+    if status is not None:
+        return status >= 500
+    return isinstance(exc, (openai.APIConnectionError, httpx.TransportError, TimeoutError))
+
+
+@dataclass
+class Circuit:
+    """Состояние circuit breaker для одной модели у одного провайдера."""
+    consecutive_failures: int = 0
+    opened_at: float | None = None
+
+
+@dataclass
+class Provider:
+    """OpenAI-совместимый эндпоинт и его здоровье.
+
+    models — какие модели обслуживает: {имя в проекте: имя у провайдера}; None — любые (OpenRouter).
+    Задержка и circuit breaker ведутся отдельно по моделям: отчёт идёт минутами, вёрстка — секунды,
+    а сбой одной модели (перегруженный free-тариф) не должен выключать остальные.
+    """
+    name: str
+    base_url: str
+    api_key_env: str | None = None
+    models: dict[str, str] | None = None
+    ewma_latency_s: dict[str, float] = field(default_factory=dict)
+    circuits: dict[str, Circuit] = field(default_factory=dict)
+    error_rate: float = 0.0
+    calls: int = 0
+    failures: int = 0
+
+    def serves(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+    def remote_model(self, model: str) -> str:
+        return self.models.get(model, model) if self.models else model
+
+
+class ProviderPool:
+    """Пул провайдеров: EWMA задержки и доли ошибок, circuit breaker, выбор самого здорового.
+
+    После failure_threshold ошибок провайдера подряд (5xx/таймаут/соединение) цепь пары
+    (провайдер, модель) размыкается на cooldown_s: запросы этой модели идут к остальным провайдерам,
+    затем пара снова получает пробный запрос (half-open) — успех замыкает цепь, ошибка размыкает
+    её ещё на cooldown_s. Последнего доступного провайдера модели цепь не выключает — для него
+    остаются обычные повторы с паузами.
+    Один экземпляр на процесс (см. llm_client), безопасен для нескольких потоков.
+    """
+
+    def __init__(self, providers: list[Provider], alpha: float = 0.2, failure_threshold: int = 3,
+                 cooldown_s: float = 30.0):
+        if not providers:
+            raise ValueError("Provider pool is empty")
+        self.providers = providers
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown_s = cooldown_s
+        self._lock = threading.Lock()
+
+    def _is_closed(self, provider: Provider, model: str, now: float) -> bool:
+        circuit = provider.circuits.get(model)
+        return circuit is None or circuit.opened_at is None or now - circuit.opened_at >= self.cooldown_s
+
+    def _serving(self, model: str) -> list[Provider]:
+        serving = [p for p in self.providers if p.serves(model)]
+        if not serving:
+            raise ProviderUnavailableError(f"No provider serves model '{model}'")
+        return serving
+
+    def _candidates(self, model: str, exclude, now: float) -> list[Provider]:
+        return [p for p in self._serving(model) if p.name not in exclude and self._is_closed(p, model, now)]
+
+    def pick(self, model: str, exclude=()) -> Provider:
+        """Самый здоровый провайдер для модели: меньше доля ошибок (с шагом 10%), затем меньше задержка.
+        Ещё не измеренные провайдеры идут первыми — так они получают пробный запрос.
+        exclude — уже опробованные в этом вызове; если кроме них никого нет, они допускаются снова."""
+        now = time.monotonic()
+        with self._lock:
+            # Пустым список быть не может: последнюю цепь модели record_failure не размыкает
+            candidates = (self._candidates(model, exclude, now) or self._candidates(model, (), now)
+                          or self._serving(model))
+            # min() стабилен: при равенстве выигрывает провайдер, объявленный раньше
+            return min(candidates, key=lambda p: (round(p.error_rate, 1), p.ewma_latency_s.get(model, 0.0)))
+
+    def has_alternative(self, model: str, exclude) -> bool:
+        """Есть ли доступный провайдер для модели кроме exclude (тогда повтор — без паузы)."""
+        with self._lock:
+            try:
+                return bool(self._candidates(model, exclude, time.monotonic()))
+            except ProviderUnavailableError:
+                return False
+
+    def record_success(self, provider: Provider, model: str, latency_s: float | None = None) -> None:
+        """latency_s=None — успех без замера (стрим: его длительность зависит от объёма текста)."""
+        with self._lock:
+            provider.calls += 1
+            provider.error_rate *= 1 - self.alpha
+            circuit = provider.circuits.pop(model, None)
+            if circuit is not None and circuit.opened_at is not None:
+                print(f"🔌 Provider '{provider.name}' recovered for '{model}', circuit closed")
+            if latency_s is not None:
+                prev = provider.ewma_latency_s.get(model)
+                provider.ewma_latency_s[model] = (
+                    latency_s if prev is None else prev + self.alpha * (latency_s - prev)
+                )
+
+    def record_failure(self, provider: Provider, model: str, exc: BaseException) -> None:
+        now = time.monotonic()
+        with self._lock:
+            provider.calls += 1
+            if not is_provider_failure(exc):
+                return
+            provider.failures += 1
+            provider.error_rate += self.alpha * (1 - provider.error_rate)
+            circuit = provider.circuits.setdefault(model, Circuit())
+            circuit.consecutive_failures += 1
+            if circuit.consecutive_failures < self.failure_threshold or not self._is_closed(provider, model, now):
+                return
+            if not self._candidates(model, (provider.name,), now):
+                # Последний провайдер модели: выключать некуда, пусть работают повторы с паузами
+                return
+            circuit.opened_at = now
+            print(f"🔌 Provider '{provider.name}' circuit open for '{model}' for {self.cooldown_s:g}s "
+                  f"({circuit.consecutive_failures} failures in a row)")
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                p.name: {
+                    "calls": p.calls,
+                    "failures": p.failures,
+                    "error_rate": round(p.error_rate, 3),
+                    "ewma_latency_s": {m: round(v, 2) for m, v in sorted(p.ewma_latency_s.items())},
+                    "open_circuits": sorted(
+                        m for m, c in p.circuits.items()
+                        if c.opened_at is not None and not self._is_closed(p, m, now)
+                    ),
+                }
+                for p in self.providers
+            }
+
+
+def load_providers(raw: str | None, default: Provider) -> list[Provider]:
+    """Провайдеры из JSON-списка (LLM_PROVIDERS); пусто или ошибка — только default.
+
+    Формат элемента: {"name": "google", "base_url": "...", "api_key_env": "GEMINI_API_KEY",
+    "models": {"google/gemini-2.0-flash-001": "gemini-2.0-flash"}}; models может быть списком
+    (имена у провайдера те же), не указан — любые модели.
+    """
+    if not raw:
+        return [default]
+    try:
+        providers = []
+        for item in json.loads(raw):
+            models = item.get("models")
+            if isinstance(models, list):
+                models = {m: m for m in models}
+            providers.append(Provider(
+                name=item["name"],
+                base_url=item["base_url"],
+                api_key_env=item.get("api_key_env"),
+                models=models,
+            ))
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"⚠️ LLM_PROVIDERS ignored (invalid config): {e}")
+        return [default]
+    return providers or [default]
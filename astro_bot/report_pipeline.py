@@ -0,0 +1,133 @@
+import asyncio
+import os
+from typing import Any
+
+from pdf_renderer import PDFReportGenerator
+from docx_renderer import DOCXReportGenerator
+
+# Сколько блоков верстать через LLM одновременно, пока пишутся следующие.
+LAYOUT_CONCURRENCY = max(1, int(os.getenv("LAYOUT_CONCURRENCY", "3")))
+
+
+class StreamingReportBuilder:
+    """Потоковая сборка PDF/DOCX: каждая готовая секция отчёта сразу
+    размечается (AstroMarkup) и конвертируется во flowables / абзацы DOCX,
+    пока LLM дописывает следующие блоки.
+
+    add_section() вызывается из on_block стрима, finish() — после конца стрима:
+    к этому моменту обычно осталось доверстать только последний блок и собрать файл.
+    Секция с уже известным номером (перегенерированный блок) заменяет прежнюю;
+    порядок в файле — по номеру секции. sync_sections() приводит набор секций
+    к итоговому тексту отчёта (после исправлений), до finish().
+    """
+
+    def __init__(self, orchestrator, client_data: Any, pdf_path: str, docx_path: str,
+                 concurrency: int = LAYOUT_CONCURRENCY):
+        self.orchestrator = orchestrator
+        self.client_data = client_data
+        self.pdf_gen = PDFReportGenerator(pdf_path)
+        self.docx_gen = DOCXReportGenerator(docx_path)
+        self._docx = None
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._order: list[int] = []  # номера секций по возрастанию
+        self._source: dict[int, str] = {}
+        # Версия секции растёт при каждой замене: задача устаревшей версии ничего не записывает
+        self._versions: dict[int, int] = {}
+        self.markup: dict[int, str] = {}
+        self._flowables: dict[int, list] = {}
+        # DOCX дописывается строго по порядку секций; _docx_written — номера уже записанных
+        self._docx_written: list[int] = []
+        self._docx_stale = False
+        self._docx_lock = asyncio.Lock()
+
+    def _touch_docx(self, n: int) -> None:
+        """Секция n меняется: если она или что-то после неё уже в DOCX — DOCX собирается заново."""
+        if any(w >= n for w in self._docx_written):
+            self._docx_stale = True
+
+    async def add_section(self, n: int, text: str) -> None:
+        previous = self._tasks.get(n)
+        if n not in self._versions:
+            self._order = sorted(self._order + [n])
+        self._versions[n] = self._versions.get(n, 0) + 1
+        self._source[n] = text
+        self.markup.pop(n, None)
+        self._flowables.pop(n, None)
+        self._touch_docx(n)
+        self._tasks[n] = asyncio.create_task(self._process(n, text, self._versions[n], previous))
+
+    async def remove_section(self, n: int) -> None:
+        if n not in self._versions:
+            return
+        self._touch_docx(n)
+        del self._versions[n]
+        self._order.remove(n)
+        self._source.pop(n, None)
+        self.markup.pop(n, None)
+        self._flowables.pop(n, None)
+        task = self._tasks.pop(n)
+        # Не отменяем: задача может быть внутри append_markup в executor-е
+        await asyncio.gather(task, return_exceptions=True)
+
+    async def sync_sections(self, sections: list[tuple[int, str]]) -> None:
+        """Оставляет ровно эти секции: лишние убирает, изменённые перевёрстывает."""
+        final = dict(sections)
+        for n in [n for n in self._order if n not in final]:
+            await self.remove_section(n)
+        for n, text in final.items():
+            if self._source.get(n) != text:
+                await self.add_section(n, text)
+
+    async def _process(self, n: int, text: str, version: int, previous: asyncio.Task | None) -> None:
+        if previous is not None:
+            # Прежняя версия секции могла уже писать в общий Document — дожидаемся, а не отменяем
+            await asyncio.gather(previous, return_exceptions=True)
+        if self._versions.get(n) != version:
+            return
+        async with self._semaphore:
+            if self._versions.get(n) != version:
+                return
+            markup = await self.orchestrator.layout_block_astromarkup_async(self.client_data, text)
+        # Если вёрстка не удалась — рендеры справятся и с сырым текстом (эвристики по строкам)
+        markup = markup.strip() or text
+        loop = asyncio.get_running_loop()
+        flowables = await loop.run_in_executor(None, self.pdf_gen.markup_to_flowables, markup)
+        if self._versions.get(n) != version:
+            return
+        self.markup[n] = markup
+        self._flowables[n] = flowables
+        await self._drain_docx()
+
+    async def _drain_docx(self) -> None:
+        loop = asyncio.get_running_loop()
+        async with self._docx_lock:
+            if self._docx is None or self._docx_stale:
+                self._docx = await loop.run_in_executor(None, self.docx_gen.new_document)
+                self._docx_written = []
+                self._docx_stale = False
+            while (not self._docx_stale and len(self._docx_written) < len(self._order)
+                   and self._order[len(self._docx_written)] in self.markup):
+                n = self._order[len(self._docx_written)]
+                # Записываем до вызова: замена секции во время append_markup пометит DOCX устаревшим
+                self._docx_written.append(n)
+                await loop.run_in_executor(None, self.docx_gen.append_markup, self._docx, self.markup[n])
+
+    async def finish(self) -> tuple[str, str]:
+        """Дожидается вёрстки всех секций и собирает файлы. Возвращает (pdf_path, docx_path)."""
+        await asyncio.gather(*(self._tasks[n] for n in self._order))
+        await self._drain_docx()
+        if self._docx_stale:
+            await self._drain_docx()
+        loop = asyncio.get_running_loop()
+        flowables = [f for n in self._order for f in self._flowables[n]]
+        pdf_path = await loop.run_in_executor(None, self.pdf_gen.build_pdf, self.client_data, flowables)
+        await loop.run_in_executor(None, self._docx.save, self.docx_gen.output_filename)
+        return pdf_path, self.docx_gen.output_filename
+
+    def full_markup(self) -> str:
+        return "\n".join(self.markup[n] for n in self._order if n in self.markup)
+
+    def cancel(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
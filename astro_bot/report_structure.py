@@ -0,0 +1,146 @@
+import re
+
+# Смысловых блоков в отчёте (вводная секция со списком планет идёт до "=== БЛОК 1 ===" и имеет номер 0).
+TOTAL_BLOCKS = 7
+
+BLOCK_HEADER_RE = re.compile(r"^[ \t]*=== БЛОК (\d+) ===[ \t]*$", re.MULTILINE)
+
+
+def block_header(n: int) -> str:
+    return f"=== БЛОК {n} ==="
+
+
+def split_report_blocks(text: str) -> list[tuple[int, str]]:
+    """Режет отчёт на секции [(0, вводная), (1, "=== БЛОК 1 ===\\n..."), ...].
+
+    Заголовок блока остаётся в тексте секции, так что "".join(...) секций
+    в исходном порядке восстанавливает отчёт. Пустая вводная не возвращается.
+    """
+    sections = []
+    matches = list(BLOCK_HEADER_RE.finditer(text))
+    intro_end = matches[0].start() if matches else len(text)
+    if text[:intro_end].strip():
+        sections.append((0, text[:intro_end]))
+    for i, m in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        sections.append((int(m.group(1)), text[m.start():end]))
+    return sections
+
+
+class BlockStreamParser:
+    """Находит границы "=== БЛОК N ===" в потоке текста по мере поступления.
+
+    feed() возвращает секции, которые точно закончились (начался следующий
+    заголовок), finish() — последнюю секцию после конца потока.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._emitted = 0  # позиция в self.text, до которой секции уже отданы
+        self._current = 0  # номер секции, которая сейчас пишется
+
+    @property
+    def current_block(self) -> int:
+        return self._current
+
+    def feed(self, chunk: str) -> list[tuple[int, str]]:
+        # Заголовок мог начаться в конце прошлого куска — пересматриваем только хвост
+        search_from = max(self._emitted, len(self.text) - 64)
+        self.text += chunk
+        done = []
+        # Заголовок считается полным только когда строка закончилась
+        while True:
+            m = BLOCK_HEADER_RE.search(self.text, search_from)
+            if m is None or m.end() >= len(self.text) or self.text[m.end()] != "\n":
+                break
+            section = self.text[self._emitted:m.start()]
+            if section.strip():
+                done.append((self._current, section))
+            self._emitted = m.start()
+            self._current = int(m.group(1))
+            search_from = m.end()
+        return done
+
+    def truncate(self, pos: int) -> None:
+        """Откатывает ещё не отданный хвост текста до позиции pos (отданные секции не трогает)."""
+        self.text = self.text[:max(pos, self._emitted)]
+
+    def finish(self) -> list[tuple[int, str]]:
+        section = self.text[self._emitted:]
+        self._emitted = len(self.text)
+        return [(self._current, section)] if section.strip() else []
+
+
+def continuation_point(text: str, truncated: bool) -> tuple[str, int] | None:
+    """Откуда продолжать недописанный отчёт: (сохраняемый текст, номер блока) или None, если всё на месте.
+
+    truncated (ответ упёрся в лимит токенов) — последний блок, скорее всего, оборван:
+    он отбрасывается и пишется заново. Иначе продолжаем со следующего после последнего блока.
+    """
+    if not text.strip():
+        return None
+    headers = list(BLOCK_HEADER_RE.finditer(text))
+    if truncated:
+        if not headers:
+            return text, 1
+        return text[:headers[-1].start()], int(headers[-1].group(1))
+    last = max((int(m.group(1)) for m in headers), default=0)
+    if last >= TOTAL_BLOCKS:
+        return None
+    return text, last + 1
+
+
+def strip_to_block(text: str, n: int) -> str | None:
+    """Текст начиная с первого заголовка блока >= n (продолжение отчёта без вступлений
+    и повторов уже написанных блоков). None — такого заголовка пока нет."""
+    for m in BLOCK_HEADER_RE.finditer(text):
+        if int(m.group(1)) >= n:
+            return text[m.start():]
+    return None
+
+
+def join_sections(sections: list[tuple[int, str]]) -> str:
+    return "".join(text for _, text in sections)
+
+
+# Только слово «блок» и его падежи: не «заблокировать», не «блокнот»
+_BLOCK_WORD = r"\bблок(?:и|а|ов|у|ам|ом|ами|е|ах)?\b"
+_BLOCK_REF_RE = re.compile(_BLOCK_WORD + r"\s*(?:№\s*)?((?:\d+(?:\s*(?:,|\bи\b|-|–)\s*)?)+)", re.IGNORECASE)
+_BLOCK_REF_BEFORE_RE = re.compile(r"\b(\d+)\s*-?\s*(?:й|ом|м)?\s+" + _BLOCK_WORD, re.IGNORECASE)
+_BLOCK_RANGE_RE = re.compile(r"(\d+)(?:\s*[-–]\s*(\d+))?")
+_INTRO_REF_RE = re.compile(r"вводн|список планет|спис\w* планет", re.IGNORECASE)
+_QUOTE_RE = re.compile(r"«([^»]{6,})»|\"([^\"]{6,})\"|“([^”]{6,})”|'([^']{6,})'")
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def locate_blocks(feedback: str, sections: list[tuple[int, str]]) -> list[int]:
+    """Номера секций, к которым относится правка пользователя.
+
+    Ищет явные ссылки ("блок 3", "блоки 2 и 5", "3-й блок", "вводная")
+    и цитаты в кавычках, найденные в тексте секций. Пустой список —
+    правку не удалось привязать к блокам (нужно переписывать отчёт целиком).
+    """
+    present = {n for n, _ in sections}
+    found: set[int] = set()
+
+    for m in _BLOCK_REF_RE.finditer(feedback):
+        # Каждая пара "a-b" раскрывается отдельно: "блоки 1-3 и 5" -> 1, 2, 3, 5
+        for first, last in _BLOCK_RANGE_RE.findall(m.group(1)):
+            start = int(first)
+            end = int(last) if last else start
+            found.update(range(start, end + 1) if start <= end else (start, end))
+    for m in _BLOCK_REF_BEFORE_RE.finditer(feedback):
+        found.add(int(m.group(1)))
+    if _INTRO_REF_RE.search(feedback):
+        found.add(0)
+
+    for m in _QUOTE_RE.finditer(feedback):
+        quote = _normalize(next(g for g in m.groups() if g))
+        for n, text in sections:
+            if quote in _normalize(text):
+                found.add(n)
+
+    return sorted(found & present)
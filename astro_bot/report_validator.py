@@ -0,0 +1,89 @@
+import os
+import re
+from typing import Any
+
+from astromarkup import INTRO_HEADER_RE, PLANET_LINE_RE
+from report_structure import TOTAL_BLOCKS, split_report_blocks
+
+# Блок короче этого (символов без заголовка) считаем оборванным/пустым.
+REPORT_BLOCK_MIN_CHARS = int(os.getenv("REPORT_BLOCK_MIN_CHARS", "800"))
+
+# Планеты вводной секции (FULL_REPORT_PROMPT выводит только первые 8) → ключи client_data
+INTRO_PLANETS = {
+    "солнце": "sun",
+    "луна": "moon",
+    "меркурий": "mercury",
+    "венера": "venus",
+    "марс": "mars",
+    "юпитер": "jupiter",
+    "сатурн": "saturn",
+    "уран": "uranus",
+}
+
+
+def parse_intro_planets(intro: str) -> list[dict[str, str]]:
+    """Списки планет из вводной секции: [{"sun": "Овен", ...}, ...] по порядку заголовков."""
+    partners: list[dict[str, str]] = []
+    for line in intro.splitlines():
+        plain = line.replace("**", "").strip()
+        if INTRO_HEADER_RE.match(plain.rstrip(":")):
+            partners.append({})
+            continue
+        m = PLANET_LINE_RE.match(plain)
+        if m and partners:
+            key = INTRO_PLANETS.get(m.group(1).lower())
+            if key:
+                partners[-1][key] = m.group(2).strip().rstrip(".")
+    return partners
+
+
+def _same_sign(a: str, b: str) -> bool:
+    return a.strip().lower().replace("ё", "е") == b.strip().lower().replace("ё", "е")
+
+
+def validate_report(report_text: str, client_data: Any = None) -> list[dict[str, Any]]:
+    """Быстрая локальная проверка структуры отчёта, без LLM.
+
+    Проверяет: вводную со списками планет, наличие блоков 1..TOTAL_BLOCKS без дублей,
+    минимальный объём каждого блока и совпадение знаков во вводной с client_data.
+    Возвращает проблемы в формате [{"block_id": N, "feedback": "..."}] (вводная — блок 0).
+    """
+    issues: list[dict[str, Any]] = []
+    sections = split_report_blocks(report_text)
+    seen: dict[int, int] = {}
+    for n, _ in sections:
+        seen[n] = seen.get(n, 0) + 1
+
+    intro = next((text for n, text in sections if n == 0), "")
+    partners = parse_intro_planets(intro)
+    if len(partners) < 2 or not all(partners[:2]):
+        issues.append({"block_id": 0, "feedback": "Нет вводной секции со списками планет обоих партнёров."})
+    elif isinstance(client_data, dict):
+        mismatches = []
+        for idx, listed in enumerate(partners[:2], start=1):
+            source = client_data.get(f"client_{idx}") or {}
+            for ru_name, key in INTRO_PLANETS.items():
+                expected = source.get(key)
+                actual = listed.get(key)
+                if isinstance(expected, str) and expected.strip() and actual and not _same_sign(actual, expected):
+                    mismatches.append(f"{ru_name.capitalize()} партнёра {idx}: «{actual}» вместо «{expected}»")
+        if mismatches:
+            issues.append({"block_id": 0, "feedback": "Знаки не совпадают с данными: " + "; ".join(mismatches)})
+
+    for n in range(1, TOTAL_BLOCKS + 1):
+        if n not in seen:
+            issues.append({"block_id": n, "feedback": "Блок отсутствует (пропущен или слит с соседним)."})
+        elif seen[n] > 1:
+            issues.append({"block_id": n, "feedback": f"Заголовок блока повторяется {seen[n]} раза."})
+
+    for n, text in sections:
+        if n == 0 or n not in range(1, TOTAL_BLOCKS + 1) or seen[n] > 1:
+            continue
+        body = re.sub(r"^.*\n", "", text, count=1).strip()
+        if len(body) < REPORT_BLOCK_MIN_CHARS:
+            issues.append({"block_id": n, "feedback": f"Блок слишком короткий ({len(body)} символов), похоже, оборван."})
+
+    unknown = sorted(n for n in seen if n > TOTAL_BLOCKS)
+    for n in unknown:
+        issues.append({"block_id": n, "feedback": "Лишний блок сверх структуры отчёта."})
+    return issues
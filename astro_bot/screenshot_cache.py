@@ -0,0 +1,58 @@
+import copy
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any
+
+
+def content_digest(image_bytes: bytes) -> str:
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class ScreenshotCache:
+    """Кэш распознанных скриншотов (client_data) в памяти процесса.
+
+    Основной ключ — Telegram file_unique_id (тот же файл, присланный повторно),
+    запасной — sha256 байтов картинки (тот же файл, загруженный заново).
+    Похожие, но не идентичные картинки не совпадают: таблицы из одного сервиса
+    различаются лишь знаками, и чужие данные отдавать нельзя.
+    Наружу всегда отдаются копии: дальше по пайплайну client_data дополняется.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_s: float = 24 * 3600):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        # file_unique_id -> (digest, client_data, created)
+        self._entries: OrderedDict[str, tuple[str | None, dict[str, Any], float]] = OrderedDict()
+        self._by_digest: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _alive(self, created: float) -> bool:
+        return self.ttl_s <= 0 or time.time() - created <= self.ttl_s
+
+    def _drop(self, file_unique_id: str) -> None:
+        digest, _, _ = self._entries.pop(file_unique_id)
+        if digest is not None and self._by_digest.get(digest) == file_unique_id:
+            del self._by_digest[digest]
+
+    def get(self, file_unique_id: str | None = None, digest: str | None = None) -> dict[str, Any] | None:
+        key = file_unique_id if file_unique_id in self._entries else self._by_digest.get(digest or "")
+        if key is None:
+            return None
+        _, data, created = self._entries[key]
+        if not self._alive(created):
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        return copy.deepcopy(data)
+
+    def put(self, file_unique_id: str, digest: str | None, client_data: dict[str, Any]) -> None:
+        if file_unique_id in self._entries:
+            self._drop(file_unique_id)
+        self._entries[file_unique_id] = (digest, copy.deepcopy(client_data), time.time())
+        if digest is not None:
+            self._by_digest[digest] = file_unique_id
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
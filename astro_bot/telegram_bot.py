@@ -2,17 +2,24 @@ import os
 import base64
 import logging
 import asyncio
+import functools
+from collections import deque
+from collections.abc import Awaitable, Callable
 from typing import Any
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 from dotenv import load_dotenv
 
 from flow_manager import AstroFlowOrchestrator
-from llm_client import LLMService
+from llm_client import close_async_client
 from prompts import IMAGE_EXTRACTION_PROMPT
 from text_input_parser import parse_text_input
 from pdf_renderer import PDFReportGenerator
 from docx_renderer import DOCXReportGenerator
+from image_tools import assess_image_quality, preprocess_image, split_regions
+from screenshot_cache import ScreenshotCache, content_digest
+from report_structure import TOTAL_BLOCKS, split_report_blocks
+from report_pipeline import StreamingReportBuilder
 
 # Настройка логирования
 logging.basicConfig(
@@ -26,13 +33,184 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
 
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Сколько апдейтов обрабатывать одновременно (глобальный лимит на все чаты).
+# 1 — старое поведение: строго по одному апдейту на весь бот.
+BOT_CONCURRENT_UPDATES = max(1, int(os.getenv("BOT_CONCURRENT_UPDATES", "32")))
+# Предобработка скриншота перед vision (меньше байт и image-токенов).
+VISION_PREPROCESS = os.getenv("VISION_PREPROCESS", "1") == "1"
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "1600"))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+# По умолчанию цвет сохраняем: партнёров в таблицах часто различают цветом (синий/красный).
+VISION_GRAYSCALE = os.getenv("VISION_GRAYSCALE", "0") == "1"
+# Локальная проверка качества (разрешение/резкость/контраст/пропорции) до вызова vision.
+VISION_QUALITY_GATE = os.getenv("VISION_QUALITY_GATE", "1") == "1"
+# full — одна картинка целиком; regions — таблицы планет и сетка аспектов отдельными фрагментами.
+VISION_EXTRACTION_MODE = os.getenv("VISION_EXTRACTION_MODE", "full")
+# Сколько ждать остальные фото пачки (альбом / несколько скринов подряд) перед распознаванием.
+PHOTO_BURST_WINDOW_S = float(os.getenv("PHOTO_BURST_WINDOW_S", "2.5"))
+# Не чаще чем раз в N секунд редактировать сообщение с прогрессом (лимиты Telegram на edit).
+PROGRESS_EDIT_INTERVAL_S = float(os.getenv("PROGRESS_EDIT_INTERVAL_S", "3"))
+
+Handler = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]
+
+
+class ChatQueues:
+    """Очередь работ на каждый чат: один обработчик на чат и общий лимит одновременных работ.
+
+    Работы одного чата выполняются строго по очереди, разных чатов — параллельно (не больше limit сразу).
+    Ожидание своей очереди ничего не занимает: ни слот concurrent_updates, ни общий слот.
+    Через очередь идут и апдейты (submit — не дожидаясь), и фоновые пачки фото (run — с ожиданием).
+    Очередь и её обработчик удаляются, когда работ в чате не осталось.
+    """
+
+    def __init__(self, limit: int = BOT_CONCURRENT_UPDATES):
+        self._queues: dict[int, deque[tuple[Callable[[], Awaitable[Any]], asyncio.Future]]] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self._slots = asyncio.Semaphore(limit)
+
+    def __len__(self) -> int:
+        return len(self._queues)
+
+    def submit(self, chat_id: int, coro_factory: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Ставит работу в очередь чата; future завершится её результатом. Отмена future отменяет работу."""
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(chat_id, deque()).append((coro_factory, future))
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return future
+
+    async def run(self, chat_id: int, coro_factory: Callable[[], Awaitable[Any]]) -> Any:
+        # Отмена ждущей задачи отменяет future, а с ним и работу в очереди
+        return await self.submit(chat_id, coro_factory)
+
+    async def _drain(self, chat_id: int) -> None:
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                coro_factory, future = queue.popleft()
+                if future.done():
+                    continue  # отменена, пока ждала очереди
+                async with self._slots:
+                    if future.done():
+                        continue
+                    job = asyncio.ensure_future(coro_factory())
+                    future.add_done_callback(lambda f, job=job: job.cancel() if f.cancelled() else None)
+                    try:
+                        await asyncio.wait([job])
+                    except asyncio.CancelledError:
+                        job.cancel()
+                        raise
+                if future.done():
+                    continue
+                if job.cancelled():
+                    future.cancel()
+                elif job.exception() is not None:
+                    future.set_exception(job.exception())
+                else:
+                    future.set_result(job.result())
+        finally:
+            for _, future in queue:
+                future.cancel()
+            del self._queues[chat_id]
+            del self._workers[chat_id]
+
+
+def _log_queued_failure(name: str, future: asyncio.Future) -> None:
+    """Ошибка апдейта из очереди чата: до error_handler python-telegram-bot она уже не дойдёт."""
+    if not future.cancelled() and future.exception() is not None:
+        logging.error("Unhandled exception in %s", name, exc_info=future.exception())
+
+
+class ThrottledStatus:
+    """Одно статусное сообщение, которое редактируется не чаще interval_s.
+
+    Промежуточные обновления, пришедшие слишком рано, схлопываются: последнее
+    из них показывается отложенно, как только истечёт interval_s.
+    force=True отправляет сразу (финальный статус) и отменяет отложенное.
+    """
+
+    def __init__(self, bot, chat_id: int, interval_s: float = PROGRESS_EDIT_INTERVAL_S):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.interval_s = interval_s
+        self._message = None
+        self._shown: str | None = None
+        self._last_edit = 0.0
+        self._pending: str | None = None
+        self._flush_task: asyncio.Task | None = None
+
+    async def update(self, text: str, force: bool = False) -> None:
+        if force:
+            self.cancel()
+        if text == self._shown:
+            self._pending = None
+            return
+        now = asyncio.get_running_loop().time()
+        wait = self.interval_s - (now - self._last_edit)
+        if self._message is not None and not force and wait > 0:
+            self._pending = text
+            if self._flush_task is None:
+                self._flush_task = asyncio.create_task(self._flush_later(wait))
+            return
+        self._pending = None
+        try:
+            if self._message is None:
+                self._message = await self.bot.send_message(chat_id=self.chat_id, text=text)
+            else:
+                await self._message.edit_text(text)
+        except Exception as e:
+            # Прогресс — не критичная часть: ошибки Telegram (flood, "message is not modified") игнорируем
+            logging.warning(f"Progress update failed for chat {self.chat_id}: {e}")
+            return
+        self._shown = text
+        self._last_edit = now
+
+    async def _flush_later(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._flush_task = None
+        if self._pending is not None:
+            await self.update(self._pending)
+
+    def cancel(self) -> None:
+        """Отменяет отложенное обновление (статус больше не нужен или сейчас будет финальным)."""
+        self._pending = None
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+
 
 class AstroBot:
     def __init__(self):
         self.orchestrator = AstroFlowOrchestrator()
-        self.llm = LLMService()
+        # Один AsyncLLMService на бота (тот же, что у оркестратора) — один пул соединений.
+        self.llm = self.orchestrator.llm
         # Память между сообщениями: сначала фото (таблица), потом текст с именами/метаданными.
         self.pending_inputs: dict[int, dict[str, Any]] = {}
+        self.chat_queues = ChatQueues()
+        # Текущие распознавания по чатам (задача пачки фото) — для /cancel.
+        self.extractions: dict[int, asyncio.Task] = {}
+        # Повторно присланные скриншоты не распознаём заново.
+        self.screenshot_cache = ScreenshotCache(
+            max_entries=int(os.getenv("SCREENSHOT_CACHE_SIZE", "256")),
+            ttl_s=float(os.getenv("SCREENSHOT_CACHE_TTL_S", str(24 * 3600))),
+        )
+
+    def serialized(self, handler: Handler) -> Handler:
+        """Оборачивает хендлер: один чат — один апдейт за раз (при concurrent_updates).
+
+        Апдейт ставится в очередь чата, и обработчик сразу возвращается: пока чат ждёт
+        свой многоминутный отчёт, его новые сообщения не держат слоты concurrent_updates.
+        """
+
+        @functools.wraps(handler)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Any:
+            chat = update.effective_chat
+            if chat is None:
+                return await handler(update, context)
+            future = self.chat_queues.submit(chat.id, lambda: handler(update, context))
+            future.add_done_callback(functools.partial(_log_queued_failure, handler.__name__))
+
+        return wrapper
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(
@@ -40,33 +218,192 @@ class AstroBot:
             text="Привет! Я Астро-Бот. 🌌\n\nОтправь мне скриншот таблицы синастрии или натальных карт, и я сделаю подробный разбор совместимости."
         )
 
+    async def cancel(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/cancel — останавливает идущее распознавание скриншота в этом чате."""
+        chat_id = update.effective_chat.id
+        task = self.extractions.get(chat_id)
+        if not task:
+            await context.bot.send_message(chat_id=chat_id, text="Сейчас нечего отменять.")
+            return
+        task.cancel()
+        await context.bot.send_message(chat_id=chat_id, text="⏹ Распознавание скриншота остановлено. Можно прислать новое фото.")
+
+    async def shutdown(self, application) -> None:
+        """Останавливает незавершённые распознавания и закрывает пул соединений (post_shutdown)."""
+        for task in list(self.extractions.values()):
+            task.cancel()
+        logging.info("LLM cache stats: %s", self.llm.cache_stats())
+        logging.info("LLM token usage: %s", self.llm.usage_stats())
+        logging.info("LLM latency: %s", self.llm.latency_stats())
+        logging.info("LLM providers: %s", self.llm.provider_stats())
+        await close_async_client()
+
+    async def _extract_image_data(self, chat_id: int, base64_image: str, regions=None) -> dict | None:
+        """Распознавание скриншота без блокировки event loop.
+
+        Если переданы regions (режим VISION_EXTRACTION_MODE=regions) — распознаём по фрагментам.
+        Отмена (через /cancel или остановку бота) отменяет задачу пачки фото,
+        а вместе с ней и все in-flight запросы к vision-моделям.
+        """
+        if regions:
+            return await self.llm.extract_data_from_regions(base64_image, regions)
+        return await self.llm.extract_data_from_image(base64_image, IMAGE_EXTRACTION_PROMPT)
+
+    @staticmethod
+    def _clearer_image_hint(client_data: dict) -> str:
+        """Подсказка пользователю прислать скрин получше (по итогам vision или локальной проверки)."""
+        issues = client_data.get("quality_issues") or []
+        if issues:
+            hint = "❌ Скриншот не подходит для распознавания: " + "; ".join(issues) + ".\n"
+        else:
+            hint = "❌ Скриншот распознан не полностью (меньше 5 планет у партнёра).\n"
+        missing = client_data.get("missing") or {}
+        m1 = ", ".join(missing.get("client_1", []) or [])
+        m2 = ", ".join(missing.get("client_2", []) or [])
+        if m1:
+            hint += f"Partner 1 не вижу: {m1}.\n"
+        if m2:
+            hint += f"Partner 2 не вижу: {m2}.\n"
+        hint += "Пожалуйста, пришлите более чёткий скрин (без сжатия, крупнее)."
+        return hint
+
+    @staticmethod
+    def _pick_photo_size(sizes):
+        """Наименьший вариант фото, которого хватает для VISION_MAX_SIDE (иначе самый крупный)."""
+        if VISION_PREPROCESS:
+            for size in sorted(sizes, key=lambda s: s.width * s.height):
+                if max(size.width, size.height) >= VISION_MAX_SIDE:
+                    return size
+        return sizes[-1]
+
+    async def _recognize_photo(self, chat_id: int, photo) -> dict | None:
+        """Скачивает фото и распознаёт его, с дедупликацией по содержимому файла.
+
+        Удачный результат кладётся в screenshot_cache под file_unique_id и sha256 байтов.
+        """
+        photo_file = await photo.get_file()
+        byte_array = bytes(await photo_file.download_as_bytearray())
+
+        digest = content_digest(byte_array)
+        cached = self.screenshot_cache.get(digest=digest)
+        if cached is not None:
+            logging.info("Screenshot cache hit by content digest (chat %s)", chat_id)
+            self.screenshot_cache.put(photo.file_unique_id, digest, cached)
+            return cached
+
+        if VISION_QUALITY_GATE:
+            problems = await asyncio.to_thread(assess_image_quality, byte_array)
+            if problems:
+                logging.info("Screenshot rejected by quality gate (chat %s): %s", chat_id, problems)
+                return {
+                    "status": "NEEDS_CLEARER_IMAGE",
+                    "missing": {"client_1": [], "client_2": []},
+                    "quality_issues": problems,
+                }
+
+        if VISION_PREPROCESS:
+            prepared = await asyncio.to_thread(
+                preprocess_image,
+                byte_array,
+                max_side=VISION_MAX_SIDE,
+                quality=VISION_JPEG_QUALITY,
+                grayscale=VISION_GRAYSCALE,
+            )
+            logging.info(
+                "Screenshot preprocessed: %d -> %d bytes (saved %d), size %s",
+                prepared.original_bytes,
+                prepared.processed_bytes,
+                prepared.bytes_saved,
+                prepared.size,
+            )
+            base64_image = prepared.base64
+        else:
+            base64_image = base64.b64encode(byte_array).decode('utf-8')
+
+        regions = None
+        if VISION_EXTRACTION_MODE == "regions":
+            regions = await asyncio.to_thread(
+                split_regions,
+                byte_array,
+                max_side=VISION_MAX_SIDE,
+                quality=VISION_JPEG_QUALITY,
+            )
+            logging.info("Screenshot split into %d region(s): %s", len(regions), [r.kind for r in regions])
+        client_data = await self._extract_image_data(chat_id, base64_image, regions)
+        if client_data and client_data.get("status") != "NEEDS_CLEARER_IMAGE":
+            self.screenshot_cache.put(photo.file_unique_id, digest, client_data)
+        return client_data
+
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Копит фото чата в пачку (альбом или несколько скринов подряд) и запускает распознавание.
+
+        Распознавание стартует через PHOTO_BURST_WINDOW_S после первого фото пачки,
+        чтобы таблица планет и сетка аспектов, присланные отдельными фото,
+        распознавались параллельно и слились в один client_data.
+        """
         chat_id = update.effective_chat.id
 
         # Создаём/обновляем состояние сразу, чтобы текст можно было прислать пока идёт распознавание
         state = self.pending_inputs.get(chat_id) or {}
+        burst = state.get("photo_burst") or []
         state.update(
             {
                 "status": "EXTRACTING",
                 "image_data": None,
                 "raw_text": state.get("raw_text"),
                 "image_message_id": update.message.message_id,
+                "photo_burst": burst,
             }
         )
         self.pending_inputs[chat_id] = state
-        
-        # 1. Скачиваем фото
-        photo_file = await update.message.photo[-1].get_file()
-        await context.bot.send_message(chat_id=chat_id, text="Получил фото! Начинаю анализ... Это займет некоторое время (около 5-10 минут). ⏳")
-        
-        byte_array = await photo_file.download_as_bytearray()
-        base64_image = base64.b64encode(byte_array).decode('utf-8')
+        burst.append(self._pick_photo_size(update.message.photo))
 
-        # 2. Распознаем данные (Gemini Vision)
-        data_extraction_msg = await context.bot.send_message(chat_id=chat_id, text="👀 Смотрю на карты... Распознаю планеты...")
-        
+        if len(burst) == 1:
+            await context.bot.send_message(chat_id=chat_id, text="Получил фото! Начинаю анализ... Это займет некоторое время (около 5-10 минут). ⏳")
+            task = asyncio.create_task(self._process_photo_burst(chat_id, update, context))
+            self.extractions[chat_id] = task
+
+    async def _process_photo_burst(self, chat_id: int, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        task = asyncio.current_task()
         try:
-            client_data = self.llm.extract_data_from_image(base64_image, IMAGE_EXTRACTION_PROMPT)
+            await asyncio.sleep(PHOTO_BURST_WINDOW_S)
+            # Пачка живёт вне обработчика апдейтов, но в общем лимите BOT_CONCURRENT_UPDATES:
+            # если текст пришёл раньше, отсюда же пишется весь отчёт
+            await self.chat_queues.run(chat_id, lambda: self._recognize_burst(chat_id, update, context))
+        except asyncio.CancelledError:
+            state = self.pending_inputs.get(chat_id) or {}
+            state["photo_burst"] = []
+            state["status"] = "IDLE"
+            raise
+        finally:
+            if self.extractions.get(chat_id) is task:
+                del self.extractions[chat_id]
+
+    async def _recognize_one(self, chat_id: int, photo) -> dict | None:
+        """Одно фото пачки: из кэша по file_unique_id или через скачивание + vision."""
+        cached = self.screenshot_cache.get(file_unique_id=photo.file_unique_id)
+        if cached is not None:
+            logging.info("Screenshot cache hit by file_unique_id (chat %s)", chat_id)
+            return cached
+        return await self._recognize_photo(chat_id, photo)
+
+    async def _recognize_burst(self, chat_id: int, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        state = self.pending_inputs.setdefault(chat_id, {})
+        photos = state.get("photo_burst") or []
+        state["photo_burst"] = []
+        if not photos:
+            return
+
+        # 2. Скачиваем и распознаем данные (Gemini Vision), все фото пачки параллельно
+        if len(photos) > 1:
+            status_text = f"👀 Получил {len(photos)} скриншота(ов) — распознаю параллельно и объединю..."
+        else:
+            status_text = "👀 Смотрю на карты... Распознаю планеты..."
+        data_extraction_msg = await context.bot.send_message(chat_id=chat_id, text=status_text)
+
+        try:
+            results = await asyncio.gather(*(self._recognize_one(chat_id, photo) for photo in photos))
+            client_data = self.llm.merge_screenshot_results(results)
             
             if not client_data:
                 state["status"] = "IDLE"
@@ -75,16 +412,7 @@ class AstroBot:
 
             if client_data.get("status") == "NEEDS_CLEARER_IMAGE":
                 state["status"] = "IDLE"
-                missing = client_data.get("missing") or {}
-                m1 = ", ".join(missing.get("client_1", []) or [])
-                m2 = ", ".join(missing.get("client_2", []) or [])
-                hint = "❌ Скриншот распознан не полностью (меньше 5 планет у партнёра).\n"
-                if m1:
-                    hint += f"Partner 1 не вижу: {m1}.\n"
-                if m2:
-                    hint += f"Partner 2 не вижу: {m2}.\n"
-                hint += "Пожалуйста, пришлите более чёткий скрин (без сжатия, крупнее)."
-                await context.bot.send_message(chat_id=chat_id, text=hint)
+                await context.bot.send_message(chat_id=chat_id, text=self._clearer_image_hint(client_data))
                 return
 
             # Сохраняем распознанные данные.
@@ -140,6 +468,9 @@ class AstroBot:
                 await self._finalize_with_text(chat_id=chat_id, raw_text=str(state.get("raw_text") or ""), update=update, context=context)
             return
 
+        except asyncio.CancelledError:
+            state["status"] = "IDLE"
+            raise
         except Exception as e:
             logging.error(f"Error handling photo: {e}")
             await context.bot.send_message(chat_id=chat_id, text=f"⚠️ Произошла внутренняя ошибка: {str(e)}")
@@ -200,33 +531,44 @@ class AstroBot:
         client_data = pending.get("client_data") or pending.get("image_data") # Fallback
 
         try:
-            loop = asyncio.get_running_loop()
-            
             # 1. Refine text
-            refined_text = await loop.run_in_executor(None, self.orchestrator.refine_report, current_report, feedback_text)
+            refined_text, changed_blocks = await self.orchestrator.refine_report_blocks_async(current_report, feedback_text)
             
             # Update state with new text
             pending["last_report_text"] = refined_text
 
-            # 2. Re-generate files (reuse logic)
-            await self._generate_and_send_files(chat_id, client_data, refined_text, update, context)
+            # 2. Re-generate files (reuse logic): переразмечаются только изменённые блоки
+            await self._generate_and_send_files(chat_id, client_data, refined_text, update, context, changed_blocks=changed_blocks)
 
         except Exception as e:
             logging.error(f"Error refining report: {e}")
             await context.bot.send_message(chat_id=chat_id, text=f"⚠️ Ошибка при обновлении отчета: {str(e)}")
 
-    async def _generate_and_send_files(self, chat_id: int, client_data: dict, report_text: str, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def _layout_sections(self, chat_id: int, client_data: dict, report_text: str, changed_blocks: list[int] | None) -> str:
+        """AstroMarkup отчёта по секциям. Разметка неизменённых блоков берётся из состояния чата,
+        заново размечаются только changed_blocks (None — всё)."""
+        state = self.pending_inputs.setdefault(chat_id, {})
+        previous = (state.get("markup_blocks") or {}) if changed_blocks is not None else {}
+        sections = split_report_blocks(report_text)
+        todo = [(n, text) for n, text in sections if n in (changed_blocks or []) or n not in previous]
+        laid_out = await asyncio.gather(
+            *(self.orchestrator.layout_block_astromarkup_async(client_data, text) for _, text in todo)
+        )
+        markup = {n: previous[n] for n, _ in sections if n in previous}
+        for (n, text), result in zip(todo, laid_out):
+            markup[n] = result.strip() or text
+        state["markup_blocks"] = markup
+        logging.info(f"Chat {chat_id}: re-laid out {len(todo)}/{len(sections)} sections")
+        return "\n".join(markup[n] for n, _ in sections)
+
+    async def _generate_and_send_files(self, chat_id: int, client_data: dict, report_text: str, update: Update, context: ContextTypes.DEFAULT_TYPE, changed_blocks: list[int] | None = None):
         """Helper to generate PDF/DOCX and send them, then wait for feedback."""
         try:
             loop = asyncio.get_running_loop()
             
             await context.bot.send_message(chat_id=chat_id, text="🧩 Применяю правки и обновляю верстку...")
             
-            def layout_task():
-                # Issues list is empty for refined reports as we assume user manually overrode check
-                return self.orchestrator.layout_report_astromarkup(client_data, report_text, [])
-
-            astromarkup_text = await loop.run_in_executor(None, layout_task)
+            astromarkup_text = await self._layout_sections(chat_id, client_data, report_text, changed_blocks)
 
             await context.bot.send_message(chat_id=chat_id, text="🎨 Пересобираю PDF...")
             pdf_filename = f"Analys_{chat_id}_{update.message.message_id}.pdf"
@@ -246,6 +588,15 @@ class AstroBot:
 
             final_docx_path = await loop.run_in_executor(None, generate_docx_task)
 
+            await self._send_report_files(chat_id, client_data, final_pdf_path, final_docx_path, context)
+
+        except Exception as e:
+            logging.error(f"Error generating files: {e}")
+            await context.bot.send_message(chat_id=chat_id, text=f"⚠️ Ошибка генерации файлов: {e}")
+
+    async def _send_report_files(self, chat_id: int, client_data: dict, final_pdf_path: str, final_docx_path: str, context: ContextTypes.DEFAULT_TYPE):
+        """Отправка готовых PDF/DOCX, удаление временных файлов и вопрос про правки."""
+        try:
             await context.bot.send_message(chat_id=chat_id, text="✨ Готово! Вот обновленная версия.")
 
             name1 = client_data.get("client_1", {}).get("name", "Partner 1")
@@ -326,8 +677,29 @@ class AstroBot:
                 ),
             )
 
-            loop = asyncio.get_running_loop()
-            report_text, issues = await loop.run_in_executor(None, self.orchestrator.process_compatibility_report, client_data)
+            status = ThrottledStatus(context.bot, chat_id)
+            await status.update(f"⏳ Пишу отчёт: 0/{TOTAL_BLOCKS} блоков готово")
+
+            # Вёрстка и конвертация каждого блока стартуют, как только блок дописан
+            builder = StreamingReportBuilder(
+                self.orchestrator,
+                client_data,
+                pdf_path=f"Analys_{chat_id}_{update.message.message_id}.pdf",
+                docx_path=f"Analys_{chat_id}_{update.message.message_id}.docx",
+            )
+
+            async def on_block(n: int, section: str) -> None:
+                await builder.add_section(n, section)
+                if n > 0:
+                    await status.update(f"⏳ Пишу отчёт: блок {n}/{TOTAL_BLOCKS} написан")
+
+            try:
+                report_text, issues = await self.orchestrator.process_compatibility_report_async(client_data, on_block=on_block)
+            except BaseException:
+                builder.cancel()
+                status.cancel()
+                raise
+            await status.update("✅ Текст отчёта готов, собираю файлы...", force=True)
 
             if report_text:
                 # Сохраняем состояние для возможного редактирования пользователем
@@ -346,8 +718,17 @@ class AstroBot:
                         parts.append(line)
                     await context.bot.send_message(chat_id=chat_id, text="\n".join(parts))
 
-                # Генерируем и отправляем файлы
-                await self._generate_and_send_files(chat_id, client_data, report_text, update, context)
+                if "Ошибка генерации" in report_text:
+                    # Стрим оборвался — частично свёрстанные блоки не нужны, рендерим сообщение об ошибке как раньше
+                    builder.cancel()
+                    await self._generate_and_send_files(chat_id, client_data, report_text, update, context)
+                else:
+                    # Файлы — строго по итоговому тексту: исправление могло убрать лишние блоки
+                    await builder.sync_sections(split_report_blocks(report_text))
+                    pdf_path, docx_path = await builder.finish()
+                    # Разметка по блокам — чтобы правки пересобирали только изменённые блоки
+                    self.pending_inputs[chat_id]["markup_blocks"] = dict(builder.markup)
+                    await self._send_report_files(chat_id, client_data, pdf_path, docx_path, context)
 
             else:
                 await context.bot.send_message(chat_id=chat_id, text="⚠️ Произошла ошибка при генерации отчёта.")
@@ -390,14 +771,25 @@ if __name__ == '__main__':
 
     astro_bot = AstroBot()
     
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    # Апдейты разных чатов обрабатываются параллельно (до BOT_CONCURRENT_UPDATES одновременно,
+    # вместе с фоновыми пачками фото), а внутри одного чата их сериализует astro_bot.serialized.
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .post_shutdown(astro_bot.shutdown)
+        .build()
+    )
     
     start_handler = CommandHandler('start', astro_bot.start)
-    photo_handler = MessageHandler(filters.PHOTO, astro_bot.handle_photo)
-    text_handler = MessageHandler(filters.TEXT & ~filters.COMMAND, astro_bot.handle_text)
-    callback_handler = CallbackQueryHandler(astro_bot.handle_callback)
+    # /cancel намеренно не сериализуется: он должен пробиться, пока чат занят распознаванием.
+    cancel_handler = CommandHandler('cancel', astro_bot.cancel)
+    photo_handler = MessageHandler(filters.PHOTO, astro_bot.serialized(astro_bot.handle_photo))
+    text_handler = MessageHandler(filters.TEXT & ~filters.COMMAND, astro_bot.serialized(astro_bot.handle_text))
+    callback_handler = CallbackQueryHandler(astro_bot.serialized(astro_bot.handle_callback))
     
     application.add_handler(start_handler)
+    application.add_handler(cancel_handler)
     application.add_handler(photo_handler)
     application.add_handler(text_handler)
     application.add_handler(callback_handler)
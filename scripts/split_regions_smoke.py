@@ -0,0 +1,86 @@
+import io
+import os
+import sys
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for path in (PROJECT_ROOT, os.path.join(PROJECT_ROOT, "astro_bot")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+from PIL import Image, ImageDraw, ImageFont
+
+from astro_bot.image_tools import split_regions
+
+PLANETS = [
+    ("Sun", "Gemini", "2°14'"),
+    ("Moon", "Pisces", "17°05'"),
+    ("Mercury", "Taurus", "21°48'"),
+    ("Venus", "Taurus", "9°31'"),
+    ("Mars", "Scorpio", "28°02'"),
+    ("Jupiter", "Cancer", "11°40'"),
+    ("Saturn", "Scorpio", "4°19'"),
+    ("Uranus", "Sagittarius", "13°57'"),
+    ("Neptune", "Capricorn", "0°33'"),
+    ("Pluto", "Scorpio", "1°26'"),
+]
+
+
+def _font(size: int):
+    try:
+        return ImageFont.truetype(os.path.join(PROJECT_ROOT, "fonts", "times.ttf"), size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def render_screenshot(second_table_x: int = 640) -> bytes:
+    """Скриншот синастрии 1200×900: две таблицы «Planet | Sign | Degree» рядом и сетка аспектов под ними."""
+    img = Image.new("RGB", (1200, 900), "white")
+    draw = ImageDraw.Draw(img)
+    font = _font(18)
+    for x0, title, color in ((40, "Partner 1", "navy"), (second_table_x, "Partner 2", "darkred")):
+        draw.text((x0, 20), title, fill=color, font=font)
+        for col, header in zip((0, 170, 360), ("Planet", "Sign", "Degree")):
+            draw.text((x0 + col, 60), header, fill="black", font=font)
+        for i, row in enumerate(PLANETS):
+            for col, cell in zip((0, 170, 360), row):
+                draw.text((x0 + col, 95 + i * 28), cell, fill=color, font=font)
+
+    # Сетка аспектов 11×11 клеток
+    gx, gy, cell = 300, 430, 40
+    for i in range(12):
+        draw.line((gx, gy + i * cell, gx + 11 * cell, gy + i * cell), fill="black", width=2)
+        draw.line((gx + i * cell, gy, gx + i * cell, gy + 11 * cell), fill="black", width=2)
+    for i in range(1, 11):
+        draw.text((gx + 12, gy + i * cell + 10), "△" if i % 2 else "□", fill="black", font=font)
+
+    out = io.BytesIO()
+    img.save(out, format="PNG")
+    return out.getvalue()
+
+
+def main() -> None:
+    regions = split_regions(render_screenshot())
+    for region in regions:
+        print(region.kind, region.box, region.partner)
+
+    planets = sorted((r for r in regions if r.kind == "planets"), key=lambda r: r.box[0])
+    aspects = [r for r in regions if r.kind == "aspects"]
+    assert len(planets) == 2 and len(aspects) == 1, "expected two planet tables and one aspect grid"
+    # Каждая таблица целиком (от «Planet» до «Degree») и только своего партнёра
+    assert planets[0].box[0] <= 40 and planets[0].box[2] >= 440 and planets[0].box[2] < 640
+    assert planets[1].box[0] > 540 and planets[1].box[2] >= 1040
+    assert [r.partner for r in planets] == [1, 2]
+
+    # Таблицы почти вплотную: промежуток между ними как между колонками — резать нельзя,
+    # обе таблицы уходят одним фрагментом (партнёров модель различает сама)
+    regions = split_regions(render_screenshot(second_table_x=560))
+    for region in regions:
+        print(region.kind, region.box, region.partner)
+    planets = [r for r in regions if r.kind == "planets"]
+    assert len(planets) == 1 and planets[0].partner is None
+    assert planets[0].box[0] <= 40 and planets[0].box[2] >= 960
+    print("ok")
+
+
+if __name__ == "__main__":
+    main()